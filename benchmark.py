@@ -0,0 +1,217 @@
+"""
+Run time and memory benchmark of AMR configurations of setrun.
+
+Every configuration is run once for each thread count, one run at a time so that the runs do not compete for cores.
+For each run the wall time, the peak resident memory of xgeoclaw, the cells advanced on each level (from the summary
+GeoClaw writes to fort.amr) and the peak error at each gauge with a NOAA station are recorded in a JSON report.
+
+    python benchmark.py [bench_dir]
+
+benchmarks the example configurations below (make .exe first), and prints the cheapest one meeting peak_error_target.
+
+    python benchmark.py --scaling [max_threads]      (or make scaling)
+
+runs a shortened simulation with 1, 2, 4, ... max_threads threads and writes the recommended thread count to
+scratch/omp_num_threads, which the Makefile and ensemble.py use from then on.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import subprocess
+
+import numpy as np
+
+import ensemble
+import setrun
+import skill
+
+
+# Example configurations, any parameters of ensemble.apply_member can be used
+example_configurations = [{"amr_levels_max": 4, "refinement_ratios": [2, 2, 2]},
+                          {"amr_levels_max": 5, "refinement_ratios": [2, 2, 2, 6]},
+                          {"amr_levels_max": 6, "refinement_ratios": [2, 2, 2, 6, 4]}]
+example_threads = [6]
+
+# Largest absolute gauge peak error (m) accepted when choosing a configuration
+peak_error_target = 0.5
+
+# Part of the run profile simulated by the shortened run of the scaling study, 12 hours of the production profile
+scaling_fraction = 1 / 6
+
+# Lowest parallel efficiency accepted when recommending a thread count
+min_efficiency = 0.5
+
+
+def read_amr_summary(outdir):
+    """Reads the summary of a finished run from fort.amr
+
+    :param str outdir: output directory of the run
+    :return: a dictionary with the "cells_advanced" on each level (list starting at level 1), the "total_cells_advanced"
+            and the "max_alloc_words" used, values are None if the run did not finish
+    """
+    summary = {"cells_advanced": [], "total_cells_advanced": None, "max_alloc_words": None}
+    path = os.path.join(outdir, "fort.amr")
+    if not os.path.exists(path):
+        return summary
+    with open(path, "r") as amr_file:
+        for line in amr_file:
+            match = re.match(r"\s*# cells advanced on level\s+(\d+)\s*=\s*(\S+)", line)
+            if match:
+                summary["cells_advanced"].append(float(match.group(2)))
+            elif line.startswith("number of cells advanced for time integration"):
+                summary["total_cells_advanced"] = float(line.split("=")[1])
+            elif "maximum alloc usage" in line:
+                summary["max_alloc_words"] = int(line.split("=")[1])
+    return summary
+
+
+def profile_run(outdir, executable, num_threads):
+    """Runs xgeoclaw in outdir and measures it
+
+    :return: the return code, the wall time (s) and the peak resident memory of xgeoclaw (bytes)
+    """
+    env = dict(os.environ, OMP_NUM_THREADS=str(num_threads))
+    start = time.perf_counter()
+    with open(os.path.join(outdir, "xgeoclaw.log"), "w") as log:
+        process = subprocess.Popen([executable], cwd=outdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 returns the resource usage of this child alone
+        _, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - start
+    # Already reaped, keep Popen from waiting for it again
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux
+    return process.returncode, wall_time, usage.ru_maxrss * 1024
+
+
+def benchmark(configurations, threads, bench_dir="_benchmark", executable="xgeoclaw"):
+    """Runs every configuration with every thread count and writes bench_dir/benchmark.json
+
+    :param list configurations: dictionaries of parameters passed to ensemble.apply_member
+    :param list threads: OpenMP thread counts to run each configuration with
+    :param str bench_dir: directory holding the run directory of each run
+    :param str executable: xgeoclaw executable built by make
+    :return: a list with one dictionary per run, holding its "configuration", "threads", "returncode", "wall_time",
+            "peak_rss" (bytes), the fort.amr summary (see read_amr_summary), the "peak_error" (m) of each gauge and the
+            largest absolute one as "max_peak_error"
+    """
+    executable = os.path.abspath(executable)
+    report = []
+    for (n, configuration) in enumerate(configurations):
+        for num_threads in threads:
+            run_dir = os.path.join(bench_dir, "config_%03d_threads_%02d" % (n, num_threads))
+            outdir = ensemble.write_member(configuration, run_dir, diagnostics=True)
+            print("Running configuration %s with %s threads..." % (n, num_threads))
+            returncode, wall_time, peak_rss = profile_run(outdir, executable, num_threads)
+
+            run = {"configuration": configuration, "threads": num_threads, "returncode": returncode,
+                   "wall_time": wall_time, "peak_rss": peak_rss}
+            run.update(read_amr_summary(outdir))
+            peak_errors = {gaugeno: values["peak_error"] for (gaugeno, values) in skill.skill(outdir).items()}
+            run["peak_error"] = {str(gaugeno): (None if np.isnan(error) else error)
+                                 for (gaugeno, error) in peak_errors.items()}
+            errors = np.abs(np.array(list(peak_errors.values()), dtype=float))
+            run["max_peak_error"] = float(errors[np.isfinite(errors)].max()) if np.isfinite(errors).any() else None
+            report.append(run)
+            print("  wall time = %.1f s  peak RSS = %.0f MB  max peak error = %s m" % (wall_time, peak_rss / 2 ** 20,
+                                                                                       run["max_peak_error"]))
+
+            # Written after every run, so that an interrupted benchmark keeps its results
+            with open(os.path.join(bench_dir, "benchmark.json"), "w") as report_file:
+                json.dump(report, report_file, indent=2)
+    return report
+
+
+def cheapest(report, max_peak_error=peak_error_target):
+    """Finds the fastest run whose gauge peaks are all within max_peak_error of the observations
+
+    :param list report: runs as returned by benchmark
+    :param float max_peak_error: largest absolute gauge peak error (m) accepted
+    :return: the run, or None if no run meets the target
+    """
+    accepted = [run for run in report if run["returncode"] == 0 and run["max_peak_error"] is not None
+                and run["max_peak_error"] <= max_peak_error]
+    return min(accepted, key=lambda run: run["wall_time"]) if accepted else None
+
+
+def thread_counts(max_threads=None):
+    """Thread counts 1, 2, 4, ... up to max_threads, which is always included
+
+    :param int max_threads: largest thread count, defaults to the number of cores
+    """
+    max_threads = max_threads or os.cpu_count() or 1
+    counts = [2 ** n for n in range(max_threads.bit_length()) if 2 ** n < max_threads]
+    return counts + [max_threads]
+
+
+def scaling_tfinal(fraction=scaling_fraction, profile=None):
+    """Final time of the shortened simulation of the scaling study
+
+    :param float fraction: part of the run profile simulated, between 0 and 1
+    :param str profile: run profile, see setrun.select_profile
+    :return: the final time (s), fraction of the way from t0 to tfinal of the run profile
+    """
+    run_profile = setrun.run_profiles[setrun.select_profile(profile)]
+    return run_profile["t0"] + fraction * (run_profile["tfinal"] - run_profile["t0"])
+
+
+def scaling(configuration=None, max_threads=None, tfinal=None, bench_dir="_scaling", executable="xgeoclaw",
+            efficiency=min_efficiency, write=True):
+    """Thread scaling study of a shortened simulation
+
+    The recommended thread count is the fastest one whose parallel efficiency (speedup over one thread divided by the
+    number of threads) is at least efficiency, so that cores are not spent for little gain.
+
+    :param dict configuration: parameters passed to ensemble.apply_member, defaults to setrun as it is
+    :param int max_threads: largest thread count, defaults to the number of cores
+    :param float tfinal: final time (s) of the shortened simulation, defaults to scaling_tfinal of the selected profile
+    :param str bench_dir: directory holding the run directory of each run
+    :param str executable: xgeoclaw executable built by make
+    :param float efficiency: lowest parallel efficiency accepted
+    :param bool write: write the recommendation to ensemble.threads_file
+    :return: the recommended thread count and the runs, each with its "speedup" and "efficiency"
+    """
+    if tfinal is None:
+        tfinal = scaling_tfinal()
+    t0 = setrun.run_profiles[setrun.select_profile()]["t0"]
+    if tfinal <= t0:
+        raise ValueError("Final time %s of the scaling study is not after t0 = %s" % (tfinal, t0))
+    configuration = dict(configuration or {}, tfinal=tfinal)
+    report = benchmark([configuration], thread_counts(max_threads), bench_dir, executable)
+    runs = [run for run in report if run["returncode"] == 0]
+    if not runs or runs[0]["threads"] != 1:
+        raise RuntimeError("The single thread run failed, see %s" % bench_dir)
+
+    for run in runs:
+        run["speedup"] = runs[0]["wall_time"] / run["wall_time"]
+        run["efficiency"] = run["speedup"] / run["threads"]
+        print("%3s threads:  wall time = %.1f s  speedup = %.2f  efficiency = %.2f" % (
+            run["threads"], run["wall_time"], run["speedup"], run["efficiency"]))
+    recommended = min((run for run in runs if run["efficiency"] >= efficiency),
+                      key=lambda run: run["wall_time"])["threads"]
+
+    with open(os.path.join(bench_dir, "scaling.json"), "w") as report_file:
+        json.dump({"recommended_threads": recommended, "runs": runs}, report_file, indent=2)
+    if write:
+        with open(ensemble.threads_file, "w") as threads_file:
+            threads_file.write("%s\n" % recommended)
+    return recommended, runs
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "--scaling":
+        recommended, _ = scaling(max_threads=int(sys.argv[2]) if len(sys.argv) == 3 else None)
+        print("Recommended OMP_NUM_THREADS = %s, written to %s" % (recommended, ensemble.threads_file))
+        sys.exit()
+
+    bench_dir = sys.argv[1] if len(sys.argv) == 2 else "_benchmark"
+    report = benchmark(example_configurations, example_threads, bench_dir)
+    best = cheapest(report)
+    if best is None:
+        print("No configuration has all gauge peaks within %s m" % peak_error_target)
+    else:
+        print("Cheapest configuration within %s m: %s with %s threads (%.1f s)" % (
+            peak_error_target, best["configuration"], best["threads"], best["wall_time"]))
+    print("Report written to %s" % os.path.join(bench_dir, "benchmark.json"))
@@ -0,0 +1,206 @@
+"""
+Checkpoints of long runs, so that an interrupted run can be continued.
+
+setrun writes a checkpoint every checkpt_interval of simulated time and, when it finds a valid checkpoint of an
+unfinished run with the same run profile in the output directory (OUTDIR of the Makefile), sets up the run to restart
+from the newest one. GeoClaw writes the fort.tckNNNNN time stamp of a checkpoint after the
+fort.chkNNNNN file itself, so checkpoints without a complete time stamp (cut off mid-dump) are never used.
+
+    python checkpoints.py [outdir]      (or make checkpointed)
+
+runs xgeoclaw like make output, removes all but the newest keep_checkpoints checkpoints while it runs, and reports the
+size and write time of each checkpoint, also recorded in outdir/checkpoints.json.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import threading
+
+
+# Run profile of the run that wrote the checkpoints, see write_profile. Named .data so that runclaw copies it into the
+# output directory with the data files
+profile_file = "run_profile.data"
+
+
+def read_time_stamp(path):
+    """Reads a fort.tckNNNNN time stamp file
+
+    :param str path: path of the time stamp file
+    :return: the time of the checkpoint and the number of steps taken, or None if the time stamp is incomplete
+    """
+    values = {}
+    with open(path, "r") as tck_file:
+        for line in tck_file:
+            if "=" in line:
+                name, value = line.split("=", 1)
+                values[name.strip()] = value.strip()
+    try:
+        return (float(values["Checkpoint file at time t"].replace("D", "E")),
+                int(values["Number of steps taken"]))
+    except (KeyError, ValueError):
+        return None
+
+
+def checkpoints(outdir="_output"):
+    """Finds the complete checkpoints of a run
+
+    :param str outdir: output directory of the run
+    :return: a list of dictionaries with the "file" name, "time", "nsteps" and "size" (bytes) of each checkpoint,
+            oldest first
+    """
+    found = []
+    if not os.path.isdir(outdir):
+        return found
+    for name in os.listdir(outdir):
+        match = re.match(r"fort\.chk(\d{5}|aaaaa|bbbbb)$", name)
+        tck_path = os.path.join(outdir, "fort.tck" + match.group(1)) if match else None
+        if tck_path is None or not os.path.exists(tck_path):
+            continue
+        stamp = read_time_stamp(tck_path)
+        if stamp is not None:
+            found.append({"file": name, "time": stamp[0], "nsteps": stamp[1],
+                          "size": os.path.getsize(os.path.join(outdir, name))})
+    return sorted(found, key=lambda checkpoint: (checkpoint["time"], checkpoint["nsteps"]))
+
+
+def write_profile(rundir, profile):
+    """Records the run profile next to the data files, from where runclaw copies it into the output directory with them
+
+    :param str rundir: directory the data files are written to
+    :param dict profile: run profile of setrun, with its "name"
+    """
+    with open(os.path.join(rundir, profile_file), "w") as profile_json:
+        json.dump(profile, profile_json, indent=2, sort_keys=True)
+
+
+def read_profile(outdir="_output"):
+    """Reads the run profile recorded by write_profile in the output directory of a run
+
+    :param str outdir: output directory of the run
+    :return: the run profile, or None if none was recorded
+    """
+    path = os.path.join(outdir, profile_file)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as profile_json:
+        try:
+            return json.load(profile_json)
+        except ValueError:
+            return None
+
+
+def latest_checkpoint(outdir="_output", tfinal=None, profile=None):
+    """Finds the checkpoint to restart from
+
+    :param str outdir: output directory of the run
+    :param float tfinal: final time of the run. A run with a checkpoint at or after tfinal has finished (GeoClaw writes
+            one at the end), so there is nothing left to continue
+    :param dict profile: run profile the run is set up with, checkpoints are only used when the run that wrote them
+            recorded the same profile (see write_profile)
+    :return: the name of the newest complete checkpoint, or None if there is none
+    """
+    if profile is not None and read_profile(outdir) != profile:
+        return None
+    found = checkpoints(outdir)
+    if tfinal is not None and any(checkpoint["time"] >= tfinal for checkpoint in found):
+        return None
+    return found[-1]["file"] if found else None
+
+
+def prune(outdir="_output", keep=2):
+    """Removes all but the newest keep complete checkpoints, with their time stamps
+
+    :param str outdir: output directory of the run
+    :param int keep: number of checkpoints kept
+    :return: names of the removed checkpoint files
+    """
+    removed = []
+    for checkpoint in checkpoints(outdir)[:-keep] if keep > 0 else []:
+        os.remove(os.path.join(outdir, checkpoint["file"]))
+        os.remove(os.path.join(outdir, checkpoint["file"].replace("chk", "tck")))
+        removed.append(checkpoint["file"])
+    return removed
+
+
+def monitor(outdir, stop, keep=2, poll_interval=0.5):
+    """Watches the checkpoints written by a run until stop is set, pruning old ones
+
+    The write time of a checkpoint is measured from when its file first appears until its time stamp is complete, so
+    it is accurate to about poll_interval.
+
+    :param str outdir: output directory of the run
+    :param threading.Event stop: set when the run has finished
+    :param int keep: number of checkpoints kept, see prune
+    :param float poll_interval: seconds between looks at outdir
+    :return: a list of dictionaries with the "file", "time", "size" and "write_time" of each new checkpoint
+    """
+    first_seen = {}
+    reported = {checkpoint["file"] for checkpoint in checkpoints(outdir)}
+    written = []
+    while True:
+        finished = stop.is_set()
+        now = time.perf_counter()
+        if os.path.isdir(outdir):
+            for name in os.listdir(outdir):
+                if name.startswith("fort.chk"):
+                    first_seen.setdefault(name, now)
+
+        for checkpoint in checkpoints(outdir):
+            if checkpoint["file"] in reported:
+                continue
+            reported.add(checkpoint["file"])
+            checkpoint["write_time"] = now - first_seen.get(checkpoint["file"], now)
+            written.append(checkpoint)
+            print("Checkpoint %s at t = %s: %.1f MB written in %.1f s" % (
+                checkpoint["file"], checkpoint["time"], checkpoint["size"] / 2 ** 20, checkpoint["write_time"]))
+            # Alternating checkpoints (fort.chkaaaaa/bbbbb) reuse their names
+            first_seen.pop(checkpoint["file"], None)
+            if checkpoint["file"][-5:] in ("aaaaa", "bbbbb"):
+                reported.discard(checkpoint["file"])
+
+        prune(outdir, keep)
+        if finished:
+            return written
+        stop.wait(poll_interval)
+
+
+def run(outdir="_output", executable="xgeoclaw", rundir=None, keep=2):
+    """Runs xgeoclaw with runclaw, as make output does, while monitoring its checkpoints
+
+    Whether the run restarts is taken from claw.data in rundir, as set by setrun.
+
+    :param str outdir: output directory of the run
+    :param str executable: xgeoclaw executable built by make
+    :param str rundir: directory with the data files written by setrun, defaults to the current directory
+    :param int keep: number of checkpoints kept, see prune
+    :return: the checkpoints written, see monitor
+    """
+    from clawpack.clawutil.runclaw import runclaw
+
+    stop = threading.Event()
+    written = []
+    watcher = threading.Thread(target=lambda: written.extend(monitor(outdir, stop, keep)))
+    watcher.start()
+    try:
+        runclaw(executable, outdir, overwrite=True, rundir=rundir)
+    finally:
+        stop.set()
+        watcher.join()
+
+    with open(os.path.join(outdir, "checkpoints.json"), "w") as report:
+        json.dump(written, report, indent=2)
+    return written
+
+
+if __name__ == '__main__':
+    import setrun
+
+    outdir = sys.argv[1] if len(sys.argv) == 2 else "_output"
+    written = run(outdir, keep=setrun.keep_checkpoints)
+    if written:
+        print("%s checkpoints, %.1f MB and %.1f s each on average" % (
+            len(written), sum(checkpoint["size"] for checkpoint in written) / len(written) / 2 ** 20,
+            sum(checkpoint["write_time"] for checkpoint in written) / len(written)))
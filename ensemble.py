@@ -0,0 +1,223 @@
+"""
+Ensemble of runs over storm, friction and AMR variants of setrun.
+
+Each member of a parameter grid gets its own run directory with the data files written by rundata.write() and its own
+_output, while all members read the same topography, RuledRectangle and storm inputs from scratch. Members are run
+with xgeoclaw as separate processes, as many at a time as the cores allow with OMP_NUM_THREADS threads each, and the
+gauge peaks of all members are collected into one table.
+
+    python ensemble.py [ensemble_dir]
+
+runs the example grid below (make .exe first).
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import gauges
+import setrun
+
+
+# Thread count recommended by the scaling study of benchmark.py, also read by the Makefile
+threads_file = os.path.join(setrun.scratch_dir, "omp_num_threads")
+
+# Example grid, see apply_member for the parameters a member can vary
+example_grid = {"holland": [{"max_wind_speed": 0.9}, {"max_wind_speed": 1.0}, {"max_wind_speed": 1.1}],
+                "friction_scale": [0.8, 1.0, 1.2]}
+
+
+def default_threads():
+    """OpenMP thread count of a run, OMP_NUM_THREADS if set, otherwise the recommendation in threads_file (or 1)"""
+    if "OMP_NUM_THREADS" in os.environ:
+        return int(os.environ["OMP_NUM_THREADS"])
+    if os.path.exists(threads_file):
+        with open(threads_file, "r") as recommended:
+            return int(recommended.read())
+    return 1
+
+
+def member_grid(grid):
+    """Expands a parameter grid into its members
+
+    :param dict grid: parameter names with the list of values to try for each
+    :return: a list of dictionaries, one per combination of values
+    """
+    names = list(grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def perturb_storm(storm_file, out_path, max_wind_speed=1.0, max_wind_radius=1.0, central_pressure_deficit=1.0,
+                  ambient_pressure=101.3e3):
+    """Writes a copy of a GeoClaw format storm with scaled Holland parameters
+
+    The columns of the storm file are scaled directly, so the times and header are copied unchanged.
+
+    :param str storm_file: GeoClaw format storm file
+    :param str out_path: path of the perturbed storm file
+    :param float max_wind_speed: factor applied to the maximum wind speed
+    :param float max_wind_radius: factor applied to the radius of maximum winds
+    :param float central_pressure_deficit: factor applied to the difference between ambient and central pressure
+    :param float ambient_pressure: ambient pressure (Pa) the deficit is taken from
+    """
+    with open(storm_file, "r") as storm:
+        header = [storm.readline() for _ in range(3)]
+    # Columns are t, longitude, latitude, max wind speed, max wind radius, central pressure and storm radius
+    data = np.loadtxt(storm_file, skiprows=3, ndmin=2)
+    data[:, 3] *= max_wind_speed
+    data[:, 4] *= max_wind_radius
+    data[:, 5] = ambient_pressure - (ambient_pressure - data[:, 5]) * central_pressure_deficit
+
+    with open(out_path, "w") as storm:
+        storm.writelines(header)
+        np.savetxt(storm, data, fmt="%20.8e")
+
+
+def apply_member(rundata, member, run_dir):
+    """Changes the rundata of setrun to one member of the ensemble
+
+    The parameters a member can set are
+      * "tfinal": final time (s), the number of output times is reduced in proportion
+      * "amr_levels_max": maximum number of refinement levels
+      * "refinement_ratios": ratios used in x, y and t
+      * "flag_levels": dictionary of flagregion names (as in setrun) with (minlevel, maxlevel)
+      * "friction_scale": factor applied to all Manning coefficients
+      * "holland": dictionary of factors passed to perturb_storm
+
+    :param rundata: ClawRunData returned by setrun.setrun()
+    :param dict member: parameters of the member
+    :param str run_dir: run directory of the member, the perturbed storm file and fgmax points are written there
+    :return: rundata
+    """
+    clawdata = rundata.clawdata
+    if "tfinal" in member:
+        duration = clawdata.tfinal - clawdata.t0
+        clawdata.tfinal = member["tfinal"]
+        clawdata.num_output_times = max(1, int(clawdata.num_output_times * (clawdata.tfinal - clawdata.t0) /
+                                               duration))
+
+    amrdata = rundata.amrdata
+    if "amr_levels_max" in member:
+        amrdata.amr_levels_max = member["amr_levels_max"]
+    if "refinement_ratios" in member:
+        amrdata.refinement_ratios_x = list(member["refinement_ratios"])
+        amrdata.refinement_ratios_y = list(member["refinement_ratios"])
+        amrdata.refinement_ratios_t = list(member["refinement_ratios"])
+
+    for flagregion in rundata.flagregiondata.flagregions:
+        levels = member.get("flag_levels", {}).get(flagregion.name.replace("Region_", "", 1))
+        if levels is not None:
+            flagregion.minlevel, flagregion.maxlevel = levels
+        # capped at amr_levels_max, as setrun does for profiles with fewer levels
+        flagregion.minlevel = min(flagregion.minlevel, amrdata.amr_levels_max)
+        flagregion.maxlevel = min(flagregion.maxlevel, amrdata.amr_levels_max)
+
+    # Fixed grids hold the points of the finest level and are monitored from the level their flagregion always refines
+    # to, both of which the member may have changed
+    if any(name in member for name in ["tfinal", "amr_levels_max", "refinement_ratios", "flag_levels"]):
+        setrun.set_fgmax_grids(rundata, points_dir=run_dir)
+
+    if "friction_scale" in member:
+        for region in rundata.friction_data.friction_regions:
+            region[3] = [coefficient * member["friction_scale"] for coefficient in region[3]]
+
+    if "holland" in member:
+        storm_file = os.path.join(run_dir, "matthew.storm")
+        perturb_storm(rundata.surge_data.storm_file, storm_file, **member["holland"])
+        rundata.surge_data.storm_file = storm_file
+    return rundata
+
+
+def write_member(member, run_dir, diagnostics=False):
+    """Writes the data files of one member into run_dir/_output
+
+    :param dict member: parameters of the member, see apply_member
+    :param str run_dir: run directory of the member
+    :param bool diagnostics: also turn on the space/memory output of AMRClaw (amrdata.sprint) in fort.amr
+    :return: the output directory of the member
+    """
+    run_dir = os.path.abspath(run_dir)
+    outdir = os.path.join(run_dir, "_output")
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    with open(os.path.join(run_dir, "member.json"), "w") as member_file:
+        json.dump(member, member_file, indent=2)
+
+    rundata = apply_member(setrun.setrun(), member, run_dir)
+    # Members always run from the start, without checkpoints
+    rundata.clawdata.restart = False
+    rundata.clawdata.checkpt_style = 0
+    rundata.amrdata.sprint = diagnostics
+    rundata.write(out_dir=outdir)
+    return outdir
+
+
+def run_member(outdir, executable, num_threads):
+    """Runs xgeoclaw in the output directory of a member, with its output going to xgeoclaw.log
+
+    :return: the return code of xgeoclaw and the wall time (s)
+    """
+    env = dict(os.environ, OMP_NUM_THREADS=str(num_threads))
+    start = time.perf_counter()
+    with open(os.path.join(outdir, "xgeoclaw.log"), "w") as log:
+        returncode = subprocess.call([executable], cwd=outdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return returncode, time.perf_counter() - start
+
+
+def run_ensemble(grid, ensemble_dir="_ensemble", executable="xgeoclaw", num_threads=None, max_workers=None):
+    """Runs every member of a parameter grid and collects the gauge peaks
+
+    The data files of all members are written first, in this process, so that the inputs in scratch are only built
+    once. Members are then run at the same time, max_workers at a time.
+
+    :param dict grid: parameter names with the list of values to try for each, see apply_member
+    :param str ensemble_dir: directory holding the run directory of each member
+    :param str executable: xgeoclaw executable built by make
+    :param int num_threads: OpenMP threads of each member, see default_threads
+    :param int max_workers: number of members run at the same time, defaults to the number of cores divided by
+            num_threads
+    :return: a list of rows with the member number, its parameters, the return code, the wall time and the peak of
+            each gauge
+    """
+    if num_threads is None:
+        num_threads = default_threads()
+    if max_workers is None:
+        max_workers = max(1, (os.cpu_count() or 1) // num_threads)
+    executable = os.path.abspath(executable)
+
+    members = member_grid(grid)
+    outdirs = [write_member(member, os.path.join(ensemble_dir, "member_%03d" % n)) for (n, member) in
+               enumerate(members)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        runs = list(pool.map(lambda outdir: run_member(outdir, executable, num_threads), outdirs))
+
+    rows = []
+    for (n, (member, outdir, (returncode, wall_time))) in enumerate(zip(members, outdirs, runs)):
+        if returncode != 0:
+            print("Member %s failed with return code %s, see %s" % (n, returncode,
+                                                                    os.path.join(outdir, "xgeoclaw.log")))
+        for (gaugeno, peak) in gauges.gauge_peaks(outdir, archive=False).items():
+            rows.append({"member": n, "parameters": json.dumps(member, sort_keys=True), "returncode": returncode,
+                         "wall_time": wall_time, "gauge": gaugeno, "peak": peak["peak"],
+                         "peak_date": peak["peak_date"], "arrival_time": peak["arrival_time"]})
+
+    with open(os.path.join(ensemble_dir, "peaks.csv"), "w", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=["member", "parameters", "returncode", "wall_time", "gauge",
+                                                      "peak", "peak_date", "arrival_time"])
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+if __name__ == '__main__':
+    ensemble_dir = sys.argv[1] if len(sys.argv) == 2 else "_ensemble"
+    run_ensemble(example_grid, ensemble_dir)
+    print("Gauge peaks of all members written to %s" % os.path.join(ensemble_dir, "peaks.csv"))
@@ -0,0 +1,146 @@
+"""
+Maximum surface, maximum speed and arrival time of the surge on the fixed grids (fgmax) over the flagregions.
+
+setrun adds a fixed grid for each of fgmax_regions, on which GeoClaw records the maxima during the run and writes them
+to fgmaxNNNN.txt at the end. These are read once into 2-D arrays, stored next to them as fgmax_<region>.npz, from which
+every later map needs only a single small read instead of a scan over all frames.
+
+    python fgmax.py [outdir] [--netcdf]
+
+writes the .npz files (and netCDF files with --netcdf) of a run and prints the maximum surface on each grid.
+"""
+
+import os
+import re
+import sys
+import glob
+
+import numpy as np
+
+from clawpack.geoclaw import topotools
+from clawpack.geoclaw.fgmax_tools import FGmaxGrid
+
+
+# 2-D fields of each fixed grid, with the columns of fgmaxNNNN.txt (num_fgmax_val = 2) they are read from
+columns = {"level": 2, "B": 3, "h": 4, "speed": 5, "h_time": 6, "speed_time": 7, "arrival_time": 8}
+fields = ["level", "B", "h", "eta", "speed", "h_time", "speed_time", "arrival_time"]
+
+
+def fgmax_grids(outdir="_output"):
+    """Finds the fixed grids of a run
+
+    :param str outdir: output directory of the run
+    :return: a dictionary of region names (from the points files setrun writes) with their FGmaxGrid, holding
+            the fgno and xy_fname, sorted by fgno
+    """
+    grids = {}
+    for path in sorted(glob.glob(os.path.join(outdir, "fgmax[0-9][0-9][0-9][0-9].txt"))):
+        fg = FGmaxGrid()
+        fg.read_fgmax_grids_data(int(re.findall(r"\d+", os.path.basename(path))[0]),
+                                 os.path.join(outdir, "fgmax_grids.data"))
+        name = re.sub(r"^fgmax_", "", os.path.splitext(os.path.basename(fg.xy_fname))[0])
+        grids[name] = fg
+    return grids
+
+
+def read_fgmax(fg, outdir="_output"):
+    """Reads the values GeoClaw wrote on a fixed grid with point_style 4
+
+    The text file is parsed in one pass and the points are placed on the grid of the points file by index.
+
+    :param fg: FGmaxGrid, see fgmax_grids
+    :param str outdir: output directory of the run
+    :return: a dictionary with the cell centers "x" and "y" of the grid and 2-D arrays of shape (len(y), len(x)) for
+            each of fields, nan (0 for "level") where there is no point or the value was never set. "eta" is the maximum
+            surface h + B at wet points, the times are in seconds relative to landfall
+    """
+    path = os.path.join(outdir, "fgmax%04d.txt" % fg.fgno)
+    with open(path, "r") as fgmax_file:
+        text = fgmax_file.read()
+    num_columns = len(text[:text.index("\n")].split())
+    data = np.array(text.split(), dtype=float).reshape((-1, num_columns))
+
+    points = topotools.Topography(fg.xy_fname, topo_type=3)
+    x, y = points.x, points.y
+    i = np.rint((data[:, 0] - x[0]) / (x[1] - x[0])).astype(int)
+    j = np.rint((data[:, 1] - y[0]) / (y[1] - y[0])).astype(int)
+
+    grid = {"x": x, "y": y}
+    for (field, column) in columns.items():
+        # GeoClaw writes -0.99999e99 for values it never set
+        values = np.where(data[:, column] < -1e50, np.nan, data[:, column])
+        grid[field] = np.full((len(y), len(x)), np.nan)
+        grid[field][j, i] = values
+    grid["level"] = np.nan_to_num(grid["level"]).astype(int)
+    grid["eta"] = np.where(grid["h"] > 0, grid["h"] + grid["B"], np.nan)
+    return grid
+
+
+def load_fgmax(name, outdir="_output"):
+    """Loads the values on the fixed grid of a region, from outdir/fgmax_<name>.npz unless the run wrote newer ones
+
+    :param str name: region name, one of setrun.fgmax_regions
+    :param str outdir: output directory of the run
+    :return: the grid as returned by read_fgmax
+    """
+    npz_path = os.path.join(outdir, "fgmax_%s.npz" % name)
+    grids = fgmax_grids(outdir)
+    if name not in grids:
+        raise ValueError("No fixed grid for %s in %s" % (name, outdir))
+    txt_path = os.path.join(outdir, "fgmax%04d.txt" % grids[name].fgno)
+    if os.path.exists(npz_path) and os.path.getmtime(npz_path) >= os.path.getmtime(txt_path):
+        with np.load(npz_path) as npz:
+            return dict(npz)
+
+    grid = read_fgmax(grids[name], outdir)
+    tmp_path = npz_path + ".tmp.npz"
+    np.savez(tmp_path, **grid)
+    os.replace(tmp_path, npz_path)
+    return grid
+
+
+def write_netcdf(grid, path):
+    """Writes the values on a fixed grid as a netCDF file with lon and lat dimensions
+
+    :param dict grid: grid as returned by read_fgmax
+    :param str path: path of the .nc file
+    """
+    import netCDF4
+
+    units = {"level": "1", "B": "m", "h": "m", "eta": "m", "speed": "m s-1", "h_time": "s", "speed_time": "s",
+             "arrival_time": "s"}
+    with netCDF4.Dataset(path, "w") as outfile:
+        outfile.Conventions = "CF-1.6"
+        outfile.title = "GeoClaw fgmax values"
+
+        outfile.createDimension("lon", grid["x"].shape[0])
+        outfile.createDimension("lat", grid["y"].shape[0])
+
+        lon = outfile.createVariable("lon", "f8", ("lon",))
+        lon.standard_name = "longitude"
+        lon.units = "degrees_east"
+        lon[:] = grid["x"]
+
+        lat = outfile.createVariable("lat", "f8", ("lat",))
+        lat.standard_name = "latitude"
+        lat.units = "degrees_north"
+        lat[:] = grid["y"]
+
+        for field in fields:
+            if field == "level":
+                variable = outfile.createVariable(field, "i1", ("lat", "lon"), zlib=True)
+            else:
+                variable = outfile.createVariable(field, "f4", ("lat", "lon"), zlib=True, fill_value=np.nan)
+            variable.units = units[field]
+            variable[:, :] = grid[field]
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != "--netcdf"]
+    outdir = args[0] if args else "_output"
+    for name in fgmax_grids(outdir):
+        grid = load_fgmax(name, outdir)
+        if "--netcdf" in sys.argv:
+            write_netcdf(grid, os.path.join(outdir, "fgmax_%s.nc" % name))
+        print("%s: %s points, max surface = %.2f m, max speed = %.2f m/s" % (
+            name, np.count_nonzero(grid["level"]), np.nanmax(grid["eta"]), np.nanmax(grid["speed"])))
@@ -0,0 +1,267 @@
+"""
+Wind and pressure fields of the Holland (1980) model storm of the run, evaluated in Python.
+
+GeoClaw only sets up the storm forcing inside the Fortran run. HollandStorm follows its holland80 model
+(model_storm_module.f90) on NumPy arrays, for many points and times at once, e.g. at the gauges or on a grid over the
+domain, to check the forcing or choose the wind_refine and R_refine thresholds in setrun. The track is interpolated in
+time like GeoClaw does. The storm parameters at each time, and the fields on a grid, are memoized, so that previews of
+the whole domain over a run take seconds.
+
+    python forcing.py [outdir]
+
+prints the strongest wind and lowest pressure at each gauge and the share of the domain above each wind_refine
+threshold, taking the storm, physics and gauges from the data files of a run.
+"""
+
+import os
+import re
+import sys
+import time
+import functools
+
+import numpy as np
+
+
+# Constants of the GeoClaw model storms
+atmos_boundary_layer = 0.9  # Ratio of the surface (10 m) wind to the wind at the top of the boundary layer
+sampling_time = 0.88  # Ratio of 10 minute to 1 minute averaged winds
+ramp_width = 100.0e3  # Width (m) over which the fields are ramped down beyond the storm radius
+omega = 2.0 * np.pi / 86164.2  # Angular velocity of the earth (1/s)
+
+
+def spherical_distance(x1, y1, x2, y2, earth_radius=6367.5e3):
+    """Great circle distance (m) between points given in degrees longitude and latitude, as in GeoClaw"""
+    dx, dy = np.radians(x2 - x1), np.radians(y2 - y1)
+    return earth_radius * 2.0 * np.arcsin(np.sqrt(np.sin(0.5 * dy) ** 2 + np.cos(np.radians(y1)) *
+                                                  np.cos(np.radians(y2)) * np.sin(0.5 * dx) ** 2))
+
+
+class HollandStorm(object):
+    """Holland (1980) wind and pressure fields of a storm in the GeoClaw storm format
+
+    The velocity of the storm at each track point is computed once, from the great circle distances to the next point.
+
+    :param str path: storm file, as written by setrun (t, longitude, latitude, max wind speed, max wind radius, central
+            pressure and storm radius in SI units)
+    :param float rho_air: density of air (kg/m^3)
+    :param float ambient_pressure: ambient pressure (Pa)
+    :param float earth_radius: radius of the earth (m)
+    :param int cache_size: number of grid fields memoized by grid_fields
+    """
+
+    def __init__(self, path, rho_air=1.15, ambient_pressure=101.3e3, earth_radius=6367.5e3, cache_size=256):
+        self.path = path
+        self.rho_air = rho_air
+        self.ambient_pressure = ambient_pressure
+        self.earth_radius = earth_radius
+
+        data = np.loadtxt(path, skiprows=3, ndmin=2)
+        (self.t, self.longitude, self.latitude, self.max_wind_speed, self.max_wind_radius, self.central_pressure,
+         self.radius) = data.T[:7]
+
+        # Velocity (m/s) from each track point to the next, the last one is kept after the last point
+        dt = np.diff(self.t)
+        mid_latitude = 0.5 * (self.latitude[:-1] + self.latitude[1:])
+        mid_longitude = 0.5 * (self.longitude[:-1] + self.longitude[1:])
+        u = np.sign(np.diff(self.longitude)) * spherical_distance(
+            self.longitude[:-1], mid_latitude, self.longitude[1:], mid_latitude, earth_radius) / dt
+        v = np.sign(np.diff(self.latitude)) * spherical_distance(
+            mid_longitude, self.latitude[:-1], mid_longitude, self.latitude[1:], earth_radius) / dt
+        self.velocity = np.column_stack([np.append(u, u[-1:]), np.append(v, v[-1:])])
+
+        self.parameters = functools.lru_cache(maxsize=None)(self._parameters)
+        self.grid_fields = functools.lru_cache(maxsize=cache_size)(self._grid_fields)
+
+    @classmethod
+    def from_output(cls, outdir="_output", **kwargs):
+        """Sets up the storm of a run from its surge.data and geoclaw.data
+
+        :param str outdir: output directory of the run, or the directory setrun wrote the data files to
+        :return: the HollandStorm
+        """
+        import clawpack.geoclaw.data as geodata
+
+        physics = geodata.GeoClawData()
+        physics.read(os.path.join(outdir, "geoclaw.data"))
+        surge_data = geodata.SurgeData()
+        surge_data.read(os.path.join(outdir, "surge.data"))
+        storm_file = surge_data.storm_file.strip().strip("'\"")
+        if int(surge_data.storm_specification_type) != 1:
+            raise ValueError("The storm of %s is not specified as holland80" % outdir)
+        return cls(storm_file, rho_air=physics.rho_air, ambient_pressure=physics.ambient_pressure,
+                   earth_radius=physics.earth_radius, **kwargs)
+
+    def _parameters(self, t):
+        """Interpolates the storm at a time, memoized as parameters(t)
+
+        :param float t: time (s)
+        :return: a dictionary with the "location" and translational "velocity" of the storm, its "max_wind_radius",
+                "max_wind_speed" at the top of the boundary layer without the translational speed, "central_pressure",
+                "pressure_deficit", Holland "B" and storm "radius"
+        """
+        t = float(t)
+        if t < self.t[0]:
+            raise ValueError("Time %s is before the first track point at %s" % (t, self.t[0]))
+
+        if t > self.t[-1]:
+            # After the last track point the storm keeps its strength and moves on with its last velocity
+            center = (self.longitude[-1], self.latitude[-1])
+            velocity = self.velocity[-1]
+            meters_per_degree = np.radians(1.0) * self.earth_radius
+            location = (center[0] + (t - self.t[-1]) * velocity[0] /
+                        (meters_per_degree * np.cos(np.radians(center[1]))),
+                        center[1] + (t - self.t[-1]) * velocity[1] / meters_per_degree)
+            values = [self.max_wind_radius[-1], self.max_wind_speed[-1], self.central_pressure[-1], self.radius[-1]]
+        else:
+            location = (np.interp(t, self.t, self.longitude), np.interp(t, self.t, self.latitude))
+            velocity = np.array([np.interp(t, self.t, self.velocity[:, 0]), np.interp(t, self.t, self.velocity[:, 1])])
+            values = [np.interp(t, self.t, column) for column in [self.max_wind_radius, self.max_wind_speed,
+                                                                   self.central_pressure, self.radius]]
+        max_wind_radius, max_wind_speed, central_pressure, radius = values
+
+        # Translational speed is removed from the maximum wind speed, which is then raised to the gradient level
+        translation = np.hypot(velocity[0], velocity[1])
+        modified_max_wind_speed = max_wind_speed - translation
+        if modified_max_wind_speed < 0:
+            velocity = velocity * max_wind_speed / translation
+            modified_max_wind_speed = 0.0
+        modified_max_wind_speed /= atmos_boundary_layer
+
+        pressure_deficit = max(self.ambient_pressure - central_pressure, 100.0)
+        B = self.rho_air * np.e * modified_max_wind_speed ** 2 / pressure_deficit
+        return {"t": t,
+                "location": (float(location[0]), float(location[1])),
+                "velocity": (float(velocity[0]), float(velocity[1])),
+                "max_wind_radius": float(max_wind_radius),
+                "max_wind_speed": float(modified_max_wind_speed),
+                "central_pressure": float(central_pressure),
+                "pressure_deficit": float(pressure_deficit),
+                "B": float(min(max(B, 1.0), 2.5)),
+                "radius": float(radius)}
+
+    def fields(self, times, x, y):
+        """Evaluates the wind and pressure fields at points and times
+
+        :param times: time or 1-D array of times (s), relative to landfall as the storm file
+        :param x: longitudes of the points (degrees), any shape broadcasting with y
+        :param y: latitudes of the points (degrees)
+        :return: the wind velocity components u and v (m/s) and the pressure (Pa) at the surface, with the shape of the
+                points, preceded by the number of times if times is an array
+        """
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        scalar = np.ndim(times) == 0
+        times = np.atleast_1d(times)
+
+        # Parameters of the storm at each time, shaped to broadcast over the points
+        storms = [self.parameters(t) for t in times]
+
+        def stacked(name, index=None):
+            values = [storm[name] if index is None else storm[name][index] for storm in storms]
+            return np.array(values).reshape((len(times),) + (1,) * x.ndim)
+
+        longitude, latitude = stacked("location", 0), stacked("location", 1)
+        translation_u, translation_v = stacked("velocity", 0), stacked("velocity", 1)
+        max_wind_radius, max_wind_speed = stacked("max_wind_radius"), stacked("max_wind_speed")
+        central_pressure, pressure_deficit = stacked("central_pressure"), stacked("pressure_deficit")
+        B, radius = stacked("B"), stacked("radius")
+
+        r = spherical_distance(x, y, longitude, latitude, self.earth_radius)
+        theta = np.arctan2(y - latitude, x - longitude)
+        f = np.abs(2.0 * omega * np.sin(np.radians(y)))
+
+        with np.errstate(divide="ignore", over="ignore", invalid="ignore"):
+            ratio = (max_wind_radius / r) ** B
+            # Points at the eye, where the profile under- or overflows
+            eye = ratio > 100
+            pressure = np.where(eye, central_pressure, central_pressure + pressure_deficit * np.exp(-ratio))
+            wind = np.where(eye, 0.0, np.sqrt(ratio * np.exp(1.0 - ratio) * max_wind_speed ** 2 + (r * f) ** 2 / 4.0)
+                            - r * f / 2.0)
+            # Translational speed tapered with the wind, added back after converting to 10 minute surface winds
+            share = np.where(max_wind_speed > 0, np.abs(wind) / max_wind_speed, 0.0)
+        wind = wind * atmos_boundary_layer * sampling_time
+
+        # Counter-clockwise on the northern hemisphere
+        rotation = np.where(y >= 0, 1.0, -1.0)
+        ramp = 0.5 * (1.0 - np.tanh((r - radius) / ramp_width))
+        u = (-rotation * wind * np.sin(theta) + share * translation_u) * ramp
+        v = (rotation * wind * np.cos(theta) + share * translation_v) * ramp
+        pressure = self.ambient_pressure + (pressure - self.ambient_pressure) * ramp
+        if scalar:
+            return u[0], v[0], pressure[0]
+        return u, v, pressure
+
+    def _grid_fields(self, t, lower, upper, num_cells):
+        # Fields at the cell centers of a grid, see grid_fields
+        x = lower[0] + (np.arange(num_cells[0]) + 0.5) * (upper[0] - lower[0]) / num_cells[0]
+        y = lower[1] + (np.arange(num_cells[1]) + 0.5) * (upper[1] - lower[1]) / num_cells[1]
+        X, Y = np.meshgrid(x, y)
+        fields = (X, Y) + self.fields(t, X, Y)
+        for array in fields:
+            # Shared between the callers of grid_fields
+            array.flags.writeable = False
+        return fields
+
+    def preview(self, times, lower, upper, num_cells):
+        """Evaluates the fields on a grid at each of times, memoized by grid_fields(t, lower, upper, num_cells)
+
+        :param times: times (s)
+        :param tuple lower: lower left corner of the grid (degrees)
+        :param tuple upper: upper right corner of the grid (degrees)
+        :param tuple num_cells: number of cells in x and y
+        :return: the longitudes and latitudes of the cell centers, as arrays of shape (num_cells[1], num_cells[0]), and
+                u, v and pressure with one such array per time
+        """
+        lower, upper, num_cells = tuple(lower), tuple(upper), tuple(int(n) for n in num_cells)
+        grids = [self.grid_fields(float(t), lower, upper, num_cells) for t in times]
+        X, Y = grids[0][:2] if grids else (None, None)
+        return (X, Y) + tuple(np.array([grid[n] for grid in grids]) for n in (2, 3, 4))
+
+
+def read_refinement(outdir="_output"):
+    """Reads wind_refine and R_refine from the surge.data of a run
+
+    :param str outdir: output directory of the run
+    :return: the lists of wind speed (m/s) and radius (m) thresholds, empty if not used
+    """
+    thresholds = {"wind_refine": [], "R_refine": []}
+    with open(os.path.join(outdir, "surge.data"), "r") as surge_file:
+        for line in surge_file:
+            match = re.match(r"(.*)=:\s*(wind_refine|R_refine)\b", line)
+            if match:
+                values = match.group(1).split()
+                if values and values[0] not in ("F", "T", "False", "True"):
+                    thresholds[match.group(2)] = [float(value) for value in values]
+    return thresholds["wind_refine"], thresholds["R_refine"]
+
+
+if __name__ == '__main__':
+    import clawpack.clawutil.data as clawutil
+    from clawpack.amrclaw.data import GaugeData
+
+    outdir = sys.argv[1] if len(sys.argv) > 1 else "_output"
+    storm = HollandStorm.from_output(outdir)
+    clawdata = clawutil.ClawInputData(2)
+    clawdata.read(os.path.join(outdir, "claw.data"))
+    times = np.arange(max(clawdata.t0, storm.t[0]), clawdata.tfinal + 1.0, 3600.0)
+
+    gauge_data = GaugeData()
+    gauge_data.read(outdir)
+    if gauge_data.gauges:
+        gaugenos, x, y = np.array(gauge_data.gauges)[:, :3].T
+        u, v, pressure = storm.fields(times, x, y)
+        speed = np.hypot(u, v)
+        for (n, gaugeno) in enumerate(gaugenos.astype(int)):
+            strongest = np.argmax(speed[:, n])
+            print("Gauge %s: wind %.1f m/s at t = %+.1f h, pressure %.1f mbar" % (
+                gaugeno, speed[strongest, n], times[strongest] / 3600.0, pressure[:, n].min() / 100.0))
+
+    # Hourly preview of the whole domain at about 0.1 degrees
+    num_cells = [int(np.ceil((clawdata.upper[i] - clawdata.lower[i]) / 0.1)) for i in range(2)]
+    start = time.perf_counter()
+    X, Y, u, v, pressure = storm.preview(times, clawdata.lower, clawdata.upper, num_cells)
+    print("Domain preview: %s times on %s x %s cells in %.2f s" % (len(times), num_cells[0], num_cells[1],
+                                                                   time.perf_counter() - start))
+    speed = np.hypot(u, v)
+    for threshold in read_refinement(outdir)[0]:
+        print("wind_refine %5.1f m/s: at most %.2f%% of the domain" % (
+            threshold, 100.0 * (speed >= threshold).mean(axis=(1, 2)).max()))
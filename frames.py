@@ -0,0 +1,322 @@
+"""
+Fast reading of binary output frames, and regional subsets of the frames.
+
+With output_format = 'binary' in setrun, each frame is written as a small text file of patch headers (fort.qNNNN) and
+one binary file holding the q arrays of all patches (fort.bNNNN). read_frame memory-maps the binary file and only
+returns the patches intersecting a region, so reading, for example, the Carolinas from a frame only touches the bytes
+of those patches.
+
+extract_regions cuts the parts of all patches overlapping each region of the regional figures out of every frame once,
+and stores them as small binary frames in outdir/regions/<region>, from which setplot draws those figures.
+
+    python frames.py [frameno] [outdir]
+
+prints the patches of a frame in the Carolinas region, and
+
+    python frames.py --extract [outdir]
+
+extracts the subsets of the regions below (setplot does this itself for the regions of its figures).
+"""
+
+import os
+import re
+import sys
+import glob
+
+import numpy as np
+
+
+# Named regions of read_frame and the command line, as [x1, x2, y1, y2]
+regions = {"Carolinas": [-80.5, -77.0, 31.5, 35.0]}
+
+
+def read_time(frameno, outdir="_output"):
+    """Reads the fort.tNNNN file of a frame
+
+    :param int frameno: frame number
+    :param str outdir: output directory of the run
+    :return: a dictionary with the frame "t", "num_eqn", "num_patches", "num_aux", "num_dim", "num_ghost" and "format"
+    """
+    names = ["t", "num_eqn", "num_patches", "num_aux", "num_dim", "num_ghost", "format"]
+    with open(os.path.join(outdir, "fort.t%04d" % frameno), "r") as t_file:
+        values = [line.split()[0] for line in t_file if line.strip()]
+    header = dict(zip(names, values))
+    header["t"] = float(header["t"].replace("D", "E"))
+    for name in names[1:6]:
+        header[name] = int(header[name])
+    header.setdefault("format", "ascii")
+    return header
+
+
+def read_patch_headers(frameno, outdir="_output"):
+    """Reads the patch headers of a binary frame from its fort.qNNNN file
+
+    :param int frameno: frame number
+    :param str outdir: output directory of the run
+    :return: an array with one row per patch and columns grid_number, AMR_level, mx, my, xlow, ylow, dx, dy
+    """
+    with open(os.path.join(outdir, "fort.q%04d" % frameno), "r") as q_file:
+        values = [line.split()[0].replace("D", "E") for line in q_file if line.strip()]
+    return np.array(values, dtype=float).reshape((-1, 8))
+
+
+def read_frame(frameno, outdir="_output", region=None, aux=False):
+    """Reads the patches of a frame intersecting a region
+
+    For binary frames the q (and aux) arrays are views into memory maps of the binary files, so only the parts of them
+    that are used are read from disk. ASCII frames are read whole with pyclaw. Ghost cells are removed.
+
+    :param int frameno: frame number
+    :param str outdir: output directory of the run
+    :param region: [x1, x2, y1, y2] extent, or a name of regions, defaults to all patches
+    :param bool aux: also return the aux arrays, which are only available for frames with their own fort.aNNNN file
+            (frame 0 if setrun writes aux only once)
+    :return: the time of the frame and a list of patches, each a dictionary with the "grid_number", "level", "lower"
+            (x, y), "delta" (dx, dy), "num_cells" (mx, my), cell centers "x" and "y", "q" as an array of shape
+            (num_eqn, mx, my) holding h, hu, hv and eta, and "aux" (None unless requested and available)
+    """
+    header = read_time(frameno, outdir)
+    if isinstance(region, str):
+        region = regions[region]
+    if not header["format"].startswith("binary"):
+        return header["t"], _read_ascii_frame(frameno, outdir, region, aux)
+    dtype = np.float32 if header["format"] == "binary32" else np.float64
+
+    headers = read_patch_headers(frameno, outdir)
+    mx, my = headers[:, 2].astype(int), headers[:, 3].astype(int)
+    xlow, ylow, dx, dy = headers[:, 4], headers[:, 5], headers[:, 6], headers[:, 7]
+    num_ghost = header["num_ghost"]
+
+    # Offsets of each patch in the binary files, which include the ghost cells
+    cells = (mx + 2 * num_ghost) * (my + 2 * num_ghost)
+    q_offsets = np.concatenate(([0], np.cumsum(cells * header["num_eqn"])))
+    aux_offsets = np.concatenate(([0], np.cumsum(cells * header["num_aux"])))
+
+    selected = np.ones(len(headers), dtype=bool)
+    if region is not None:
+        x1, x2, y1, y2 = region
+        selected = (xlow < x2) & (xlow + mx * dx > x1) & (ylow < y2) & (ylow + my * dy > y1)
+
+    q_map = np.memmap(os.path.join(outdir, "fort.b%04d" % frameno), dtype=dtype, mode="r")
+    aux_path = os.path.join(outdir, "fort.a%04d" % frameno)
+    aux_map = np.memmap(aux_path, dtype=dtype, mode="r") if aux and os.path.exists(aux_path) else None
+
+    def patch_array(data, offsets, n, num_fields):
+        shape = (num_fields, mx[n] + 2 * num_ghost, my[n] + 2 * num_ghost)
+        array = data[offsets[n]:offsets[n + 1]].reshape(shape, order="F")
+        return array[:, num_ghost:num_ghost + mx[n], num_ghost:num_ghost + my[n]]
+
+    patches = []
+    for n in np.flatnonzero(selected):
+        patches.append({"grid_number": int(headers[n, 0]),
+                        "level": int(headers[n, 1]),
+                        "lower": (xlow[n], ylow[n]),
+                        "delta": (dx[n], dy[n]),
+                        "num_cells": (mx[n], my[n]),
+                        "x": xlow[n] + dx[n] * (np.arange(mx[n]) + 0.5),
+                        "y": ylow[n] + dy[n] * (np.arange(my[n]) + 0.5),
+                        "q": patch_array(q_map, q_offsets, n, header["num_eqn"]),
+                        "aux": patch_array(aux_map, aux_offsets, n, header["num_aux"]) if aux_map is not None
+                        else None})
+    return header["t"], patches
+
+
+def _overlaps(patch, region):
+    # True if a patch intersects the [x1, x2, y1, y2] region
+    x1, x2, y1, y2 = region
+    (xlow, ylow), (dx, dy), (mx, my) = patch["lower"], patch["delta"], patch["num_cells"]
+    return xlow < x2 and xlow + mx * dx > x1 and ylow < y2 and ylow + my * dy > y1
+
+
+def _read_ascii_frame(frameno, outdir, region, aux):
+    # ASCII frames have to be read whole, with pyclaw
+    from clawpack.pyclaw import solution
+
+    framesoln = solution.Solution(frameno, path=outdir, file_format="ascii", read_aux=aux)
+    return solution_patches(framesoln, region, aux)
+
+
+def solution_patches(framesoln, region=None, aux=False):
+    """Returns the patches of a pyclaw Solution intersecting a region, in the form of read_frame
+
+    :param framesoln: pyclaw Solution of a frame
+    :param list region: [x1, x2, y1, y2] extent, defaults to all patches
+    :param bool aux: also return the aux arrays
+    :return: a list of patches, see read_frame
+    """
+    patches = []
+    for state in framesoln.states:
+        dimensions = state.patch.dimensions
+        patch = {"grid_number": state.patch.patch_index,
+                 "level": state.patch.level,
+                 "lower": tuple(dimension.lower for dimension in dimensions),
+                 "delta": tuple(dimension.delta for dimension in dimensions),
+                 "num_cells": tuple(dimension.num_cells for dimension in dimensions),
+                 "x": dimensions[0].centers,
+                 "y": dimensions[1].centers,
+                 "q": state.q,
+                 "aux": state.aux if aux else None}
+        if region is None or _overlaps(patch, region):
+            patches.append(patch)
+    return patches
+
+
+def to_solution(t, patches):
+    """Makes a pyclaw Solution, as visclaw plots, out of patches in the form of read_frame
+
+    :param float t: time of the frame
+    :param list patches: patches as returned by read_frame, crop_patch or solution_patches
+    :return: the Solution, holding the q arrays of the patches without copying them
+    """
+    from clawpack import pyclaw
+
+    framesoln = pyclaw.Solution()
+    for patch in patches:
+        dimensions = [pyclaw.geometry.Dimension(lower, lower + num_cells * delta, num_cells, name=name)
+                      for (lower, delta, num_cells, name) in zip(patch["lower"], patch["delta"], patch["num_cells"],
+                                                                 "xy")]
+        state = pyclaw.State(pyclaw.geometry.Patch(dimensions), patch["q"].shape[0],
+                             0 if patch["aux"] is None else patch["aux"].shape[0])
+        state.patch.patch_index = patch["grid_number"]
+        state.patch.level = patch["level"]
+        state.t = t
+        state.q = patch["q"]
+        if patch["aux"] is not None:
+            state.aux = patch["aux"]
+        framesoln.states.append(state)
+    framesoln.domain = pyclaw.geometry.Domain([state.patch for state in framesoln.states]) if patches else None
+    return framesoln
+
+
+def region_outdir(outdir, name):
+    """Directory holding the subsets of the frames in outdir for the region name"""
+    return os.path.join(outdir, "regions", re.sub(r"\W+", "_", name).strip("_").lower())
+
+
+def crop_patch(patch, region):
+    """Cuts the cells of a patch overlapping a region out of it
+
+    :param dict patch: patch as returned by read_frame
+    :param list region: [x1, x2, y1, y2] extent
+    :return: a patch of the same form holding only the overlapping cells
+    """
+    x1, x2, y1, y2 = region
+    (xlow, ylow), (dx, dy), (mx, my) = patch["lower"], patch["delta"], patch["num_cells"]
+    i0, i1 = max(0, int(np.floor((x1 - xlow) / dx))), min(mx, int(np.ceil((x2 - xlow) / dx)))
+    j0, j1 = max(0, int(np.floor((y1 - ylow) / dy))), min(my, int(np.ceil((y2 - ylow) / dy)))
+    return dict(patch, lower=(xlow + i0 * dx, ylow + j0 * dy), num_cells=(i1 - i0, j1 - j0),
+                x=patch["x"][i0:i1], y=patch["y"][j0:j1], q=patch["q"][:, i0:i1, j0:j1], aux=None)
+
+
+def write_frame(frameno, outdir, t, patches):
+    """Writes patches as a binary frame without ghost cells or aux arrays, readable by pyclaw and read_frame
+
+    Each file is written under a temporary name and then renamed, so that parallel plotting processes extracting the
+    same frame never see a partly written one.
+
+    :param int frameno: frame number
+    :param str outdir: directory the fort.t, fort.q and fort.b files are written to
+    :param float t: time of the frame
+    :param list patches: patches as returned by read_frame
+    """
+    paths = [os.path.join(outdir, "fort.%s%04d" % (kind, frameno)) for kind in "qbt"]
+    temporary = ["%s.%s" % (path, os.getpid()) for path in paths]
+    num_eqn = patches[0]["q"].shape[0] if patches else 4
+    with open(temporary[0], "w") as q_file, open(temporary[1], "wb") as b_file:
+        for patch in patches:
+            q_file.write("%6i                 grid_number\n%6i                 AMR_level\n" % (patch["grid_number"],
+                                                                                           patch["level"]))
+            q_file.write("%6i                 mx\n%6i                 my\n" % patch["num_cells"])
+            q_file.write("%26.16e    xlow\n%26.16e    ylow\n" % patch["lower"])
+            q_file.write("%26.16e    dx\n%26.16e    dy\n\n" % patch["delta"])
+            np.asarray(patch["q"], dtype=np.float64).ravel(order="F").tofile(b_file)
+    with open(temporary[2], "w") as t_file:
+        t_file.write("%26.16e    time\n%6i                 meqn\n%6i                 ngrids\n" % (t, num_eqn,
+                                                                                               len(patches)))
+        t_file.write("%6i                 naux\n%6i                 ndim\n%6i                 nghost\n" % (0, 2, 0))
+        t_file.write("binary64              format\n")
+    # fort.t last, as GeoClaw does, since a frame is only used once its fort.t file exists
+    for (path, temporary_path) in zip(paths, temporary):
+        os.replace(temporary_path, path)
+
+
+def extract_regions(outdir, regions, framenos=None):
+    """Stores the parts of every frame overlapping each region as separate frames
+
+    Each frame is read once, and only frames that are newer than their subsets, or regions whose extent changed, are
+    extracted, so this can be called again while a run is going.
+
+    :param str outdir: output directory of the run
+    :param dict regions: region names with [x1, x2, y1, y2] extents
+    :param list framenos: frames to extract, defaults to all frames in outdir
+    :return: the number of frames extracted
+    """
+    if framenos is None:
+        framenos = sorted(int(path[-4:]) for path in glob.glob(os.path.join(outdir, "fort.t[0-9][0-9][0-9][0-9]")))
+    for (name, extent) in regions.items():
+        if not os.path.exists(region_outdir(outdir, name)):
+            os.makedirs(region_outdir(outdir, name))
+        # Subsets of a region whose extent changed are extracted again
+        extent_path = os.path.join(region_outdir(outdir, name), "extent.txt")
+        if not os.path.exists(extent_path) or not np.allclose(np.loadtxt(extent_path), extent):
+            for path in glob.glob(os.path.join(region_outdir(outdir, name), "fort.t[0-9][0-9][0-9][0-9]")):
+                os.remove(path)
+            np.savetxt(extent_path, np.asarray(extent, dtype=float))
+
+    # Only the part of a frame covering all regions is read
+    extents = np.array(list(regions.values()), dtype=float)
+    bounds = [extents[:, 0].min(), extents[:, 1].max(), extents[:, 2].min(), extents[:, 3].max()]
+
+    extracted = 0
+    for frameno in framenos:
+        source_time = os.path.getmtime(os.path.join(outdir, "fort.t%04d" % frameno))
+        stale = [name for name in regions
+                 if not os.path.exists(os.path.join(region_outdir(outdir, name), "fort.t%04d" % frameno))
+                 or os.path.getmtime(os.path.join(region_outdir(outdir, name), "fort.t%04d" % frameno)) < source_time]
+        if not stale:
+            continue
+        t, patches = read_frame(frameno, outdir, region=bounds)
+        for name in stale:
+            write_frame(frameno, region_outdir(outdir, name), t,
+                        [crop_patch(patch, regions[name]) for patch in patches if _overlaps(patch, regions[name])])
+        extracted += 1
+    return extracted
+
+
+def read_aux_once(plotdata):
+    """Makes visclaw read the aux arrays of frame 0 only
+
+    When setrun writes aux only once, visclaw would read fort.a0000 for every frame, whose patches do not match those
+    of later frames. Figures that need aux arrays should then not be plotted.
+
+    :param plotdata: ClawPlotData of setplot
+    """
+    from clawpack.pyclaw import solution
+
+    def getframe(frameno, outdir=None, refresh=False):
+        key = (frameno, os.path.abspath(outdir or plotdata.outdir))
+        if refresh or key not in plotdata.framesoln_dict:
+            framesoln = solution.Solution(frameno, path=key[1], file_prefix=plotdata.file_prefix,
+                                          file_format=plotdata.format, read_aux=(frameno == 0))
+            if not plotdata.save_frames:
+                plotdata.framesoln_dict.clear()
+            plotdata.framesoln_dict[key] = framesoln
+        return plotdata.framesoln_dict[key]
+
+    # ClawPlotData only accepts its declared attributes
+    object.__setattr__(plotdata, "getframe", getframe)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "--extract":
+        outdir = sys.argv[2] if len(sys.argv) > 2 else "_output"
+        print("Extracted %s frames of %s" % (extract_regions(outdir, regions), ", ".join(regions)))
+        sys.exit()
+
+    frameno = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    outdir = sys.argv[2] if len(sys.argv) > 2 else "_output"
+    t, patches = read_frame(frameno, outdir, region="Carolinas")
+    print("Frame %s at t = %s: %s patches in the Carolinas" % (frameno, t, len(patches)))
+    for patch in patches:
+        print("  level %s  %s x %s cells  max eta = %.3f" % (patch["level"], patch["num_cells"][0],
+                                                            patch["num_cells"][1], patch["q"][3].max()))
@@ -0,0 +1,223 @@
+"""
+Post-processing of the gauge output of a run.
+
+Each gauge file is read in one vectorized pass, so runs with many gauges and dense output stay fast. All gauges of a run
+are then packed into one columnar archive, outdir/gauges.npz, holding each column of each gauge as a typed array, from
+which a single column of a single gauge is read without parsing or loading the rest.
+
+    python gauges.py [outdir]
+
+prints the peak surge at each gauge, with the time of the peak and the arrival time of the surge.
+"""
+
+import os
+import re
+import sys
+import glob
+import datetime
+
+import numpy as np
+
+
+# Landfall time, gauge times are in seconds relative to it
+landfall_date = datetime.datetime(2016, 10, 8, 12)
+
+# Columns of the gauge files
+columns = ["level", "t", "h", "hu", "hv", "eta"]
+
+# Names of the q fields in the gauge files
+q_names = {1: "h", 2: "hu", 3: "hv"}
+
+
+def gauge_files(outdir="_output"):
+    """Finds the gauge files of a run
+
+    :param str outdir: output directory of the run
+    :return: a dictionary of gauge numbers with the paths of their gauge files, sorted by gauge number
+    """
+    paths = {}
+    for path in glob.glob(os.path.join(outdir, "gauge*.txt")):
+        match = re.match(r"gauge(\d+)\.txt$", os.path.basename(path))
+        if match:
+            paths[int(match.group(1))] = path
+    return dict(sorted(paths.items()))
+
+
+def read_gauge(path):
+    """Reads a gauge file written by GeoClaw
+
+    Data following the header of the .txt file is read with a single np.loadtxt call. If the header announces binary
+    output, the data is read from the .bin file of the same name instead.
+
+    :param str path: path to gaugeNNNNN.txt
+    :return: header as a dictionary with gauge "id", "location", "num_var", the names of the "columns" and the
+            "dtype" of the values, and the data as an ndarray with one row per output time and columns level, t, h, hu,
+            hv, eta followed by any aux fields (named auxN after their index in aux)
+    """
+    with open(path, "r") as gauge_file:
+        first = gauge_file.readline().split()
+        header = {"id": int(first[2]),
+                  "location": (float(first[4]), float(first[5])),
+                  "num_var": int(first[-1]),
+                  "columns": list(columns),
+                  "dtype": np.float64}
+        binary = None
+        for line in gauge_file:
+            if not line.startswith("#"):
+                break
+            if line.startswith("# level"):
+                # e.g. "# level, time, q[  1  2  3], eta, aux[  4  5  6]"
+                q_fields, aux_fields = [re.findall(r"\d+", part) for part in re.findall(r"\[([^]]*)\]", line)]
+                header["columns"] = (["level", "t"] + [q_names.get(int(n), "q%s" % n) for n in q_fields] + ["eta"] +
+                                     ["aux%s" % n for n in aux_fields])
+            if "file format" in line and "binary" in line:
+                binary = np.float32 if "binary32" in line else np.float64
+                header["dtype"] = binary
+
+    if binary is not None:
+        data = np.fromfile(os.path.splitext(path)[0] + ".bin", dtype=binary)
+        data = data.reshape((-1, 2 + header["num_var"])).astype(float)
+    else:
+        data = np.loadtxt(path, comments="#", ndmin=2)
+    return header, data
+
+
+def read_columns(path):
+    """Reads a gauge file into its columns
+
+    :param str path: path to gaugeNNNNN.txt
+    :return: the header, see read_gauge, and a dictionary of the header columns with their values
+    """
+    header, data = read_gauge(path)
+    data = data.reshape((-1, len(header["columns"])))
+    return header, {column: data[:, n] for (n, column) in enumerate(header["columns"])}
+
+
+def archive_path(outdir="_output"):
+    """Path of the gauge archive of a run"""
+    return os.path.join(outdir, "gauges.npz")
+
+
+def write_archive(outdir="_output"):
+    """Packs the gauges of a run into outdir/gauges.npz
+
+    The archive holds an "index" with the gauge number, location and number of rows of each gauge, and an array per
+    column of each gauge named gaugeNNNNN/<column>: "level" as int16 and the others as floats of the precision of the
+    gauge output. It is written uncompressed, so that each array is read straight from its place in the file.
+
+    :param str outdir: output directory of the run
+    :return: the path of the archive
+    """
+    arrays = {}
+    index = []
+    for (gaugeno, path) in gauge_files(outdir).items():
+        header, columns = read_columns(path)
+        index.append((gaugeno, header["location"][0], header["location"][1], columns["t"].size))
+        for (column, values) in columns.items():
+            dtype = np.int16 if column == "level" else header["dtype"]
+            arrays["gauge%05d/%s" % (gaugeno, column)] = values.astype(dtype)
+    arrays["index"] = np.array(index, dtype=[("gaugeno", "i4"), ("x", "f8"), ("y", "f8"), ("rows", "i8")])
+
+    path = archive_path(outdir)
+    tmp_path = "%s.%s.npz" % (path, os.getpid())
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+def update_archive(outdir="_output"):
+    """Writes outdir/gauges.npz again if a gauge file is newer than it, or gauges were added or removed
+
+    :param str outdir: output directory of the run
+    :return: the path of the archive
+    """
+    path = archive_path(outdir)
+    paths = gauge_files(outdir)
+    if os.path.exists(path):
+        archived = os.path.getmtime(path)
+        sources = [os.path.splitext(source)[0] + ".bin" for source in paths.values()] + list(paths.values())
+        if all(os.path.getmtime(source) <= archived for source in sources if os.path.exists(source)):
+            with np.load(path) as archive:
+                if list(archive["index"]["gaugeno"]) == list(paths):
+                    return path
+    return write_archive(outdir)
+
+
+def archive_index(outdir="_output"):
+    """Reads the index of the gauge archive of a run, see write_archive
+
+    :param str outdir: output directory of the run
+    :return: a structured array with the gaugeno, x, y and rows of each gauge
+    """
+    with np.load(update_archive(outdir)) as archive:
+        return archive["index"]
+
+
+def read_column(gaugeno, column, outdir="_output", archive=True):
+    """Reads one column of one gauge
+
+    With archive, the column is read from the gauge archive of the run, which is written (to outdir/gauges.npz) first
+    if it is out of date, and only the bytes of that array are read. Otherwise the gauge file is parsed and nothing is
+    written.
+
+    :param int gaugeno: gauge number
+    :param str column: one of columns, or auxN for the aux fields recorded with aux_out_fields
+    :param str outdir: output directory of the run
+    :param bool archive: read through the gauge archive
+    :return: the column as an ndarray
+    """
+    if not archive:
+        path = gauge_files(outdir).get(gaugeno)
+        columns = read_columns(path)[1] if path is not None else {}
+        if column not in columns:
+            raise KeyError("No column %s of gauge %s in %s" % (column, gaugeno, outdir))
+        return columns[column]
+
+    with np.load(update_archive(outdir)) as gauge_archive:
+        name = "gauge%05d/%s" % (gaugeno, column)
+        if name not in gauge_archive.files:
+            raise KeyError("No column %s of gauge %s in %s" % (column, gaugeno, archive_path(outdir)))
+        return gauge_archive[name]
+
+
+def gauge_peaks(outdir="_output", landfall=landfall_date, arrival_tol=0.5, archive=True):
+    """Finds the peak surface at each gauge of a run
+
+    :param str outdir: output directory of the run
+    :param datetime landfall: landfall time the gauge times are relative to
+    :param float arrival_tol: surface elevation (m) at which the surge is considered to have arrived
+    :param bool archive: read the gauges through the gauge archive, which writes outdir/gauges.npz when it is out of
+            date (see read_column), rather than parsing the gauge files without writing anything
+    :return: a dictionary of gauge numbers with dictionaries holding the "peak" surface (m), "peak_time" in seconds
+            relative to landfall, its "peak_date", and the "arrival_time" in seconds relative to landfall (nan if the
+            surface never reached arrival_tol)
+    """
+    series = {}
+    if archive:
+        with np.load(update_archive(outdir)) as gauge_archive:
+            for gaugeno in gauge_archive["index"]["gaugeno"].tolist():
+                series[gaugeno] = gauge_archive["gauge%05d/t" % gaugeno], gauge_archive["gauge%05d/eta" % gaugeno]
+    else:
+        for (gaugeno, path) in gauge_files(outdir).items():
+            columns = read_columns(path)[1]
+            series[gaugeno] = columns["t"], columns["eta"]
+
+    peaks = {}
+    for (gaugeno, (t, eta)) in series.items():
+        if t.size == 0:
+            continue
+
+        peak = np.argmax(eta)
+        arrived = eta >= arrival_tol
+        peaks[gaugeno] = {"peak": eta[peak],
+                          "peak_time": t[peak],
+                          "peak_date": landfall + datetime.timedelta(seconds=float(t[peak])),
+                          "arrival_time": t[np.argmax(arrived)] if arrived.any() else np.nan}
+    return peaks
+
+
+if __name__ == '__main__':
+    outdir = sys.argv[1] if len(sys.argv) == 2 else "_output"
+    for (gaugeno, peak) in gauge_peaks(outdir).items():
+        print("Gauge %s:  surge = %s  date = %s  arrival = %.0f s" % (gaugeno, peak["peak"], peak["peak_date"],
+                                                                    peak["arrival_time"]))
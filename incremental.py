@@ -0,0 +1,185 @@
+"""
+Incremental plotting, for following a long run while it goes.
+
+make plots draws every figure of every frame again. Here each PNG is recorded in a manifest in the plot directory,
+together with the key of what it was drawn from: the output of its frame (or gauge) and the configuration of its figure
+in setplot. Only PNGs whose key changed are drawn, that is the figures of new frames, figures changed in setplot and the
+gauge figures while the gauges are still being written. The HTML and LaTeX index pages are then made again from all
+PNGs, without drawing anything.
+
+    python incremental.py [outdir] [plotdir]      (or make incremental_plots)
+"""
+
+import os
+import sys
+import glob
+import time
+import types
+import hashlib
+
+import numpy as np
+
+from inputcache import Manifest, make_key, file_stamp
+
+
+def describe(value, seen=None):
+    """Returns a json serializable description of a setplot value, which changes when the value does
+
+    Plot objects are described by their attributes and functions by their code, constants and closures, so that a
+    figure is recognized as changed whatever part of its configuration was edited.
+
+    :param value: value to describe, e.g. a ClawPlotFigure
+    :param set seen: ids of the objects being described, to stop at cycles
+    """
+    seen = set() if seen is None else seen
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if id(value) in seen:
+        return "<cycle>"
+    seen = seen | {id(value)}
+
+    if isinstance(value, (list, tuple)):
+        return [describe(item, seen) for item in value]
+    if isinstance(value, dict):
+        return sorted([str(key), describe(item, seen)] for (key, item) in value.items())
+    if isinstance(value, np.ndarray):
+        return hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, types.CodeType):
+        return [value.co_name, value.co_code.hex(), list(value.co_names), describe(value.co_consts, seen)]
+    if isinstance(value, (types.FunctionType, types.MethodType)):
+        function = getattr(value, "__func__", value)
+        closure = [cell.cell_contents for cell in function.__closure__ or []]
+        return [function.__qualname__, describe(function.__code__, seen), describe(function.__defaults__, seen),
+                describe(closure, seen)]
+    if hasattr(value, "_attributes"):
+        # ClawData objects such as the plot figures, axes and items
+        return [type(value).__name__, [[name, describe(getattr(value, name), seen)] for name in value._attributes]]
+    if hasattr(value, "name") and hasattr(value, "N"):
+        # matplotlib colormaps
+        return [value.name, describe(value(np.linspace(0, 1, value.N)), seen)]
+    return type(value).__name__
+
+
+def stale_plots(plotdata, manifest):
+    """Finds the PNGs that are missing or were drawn from other output or figure configurations
+
+    :param plotdata: ClawPlotData set up by setplot
+    :param Manifest manifest: manifest of the PNGs in plotdata.plotdir
+    :return: dictionaries of frame and gauge numbers with the figure numbers to draw for each, the keys of all PNGs and
+            the set of PNGs to draw
+    """
+    figures = [plotdata.plotfigure_dict[name] for name in plotdata._fignames]
+    figures = [figure for figure in figures if figure.show]
+    figure_keys = {figure.figno: make_key(describe(figure)) for figure in figures}
+
+    framenos = sorted(int(path[-4:]) for path in glob.glob(os.path.join(plotdata.outdir, "fort.t[0-9][0-9][0-9][0-9]")))
+    gaugenos = sorted(int(os.path.basename(path)[5:10])
+                      for path in glob.glob(os.path.join(plotdata.outdir, "gauge[0-9][0-9][0-9][0-9][0-9].txt")))
+
+    frames, gauges, keys, stale = {}, {}, {}, set()
+    for figure in figures:
+        if figure.type == "each_frame":
+            inputs = [("frame%04d" % n, os.path.join(plotdata.outdir, "fort.t%04d" % n), frames) for n in framenos]
+        elif figure.type == "each_gauge":
+            inputs = [("gauge%04d" % n, os.path.join(plotdata.outdir, "gauge%05d.txt" % n), gauges) for n in gaugenos]
+        else:
+            continue
+        for (prefix, path, todo) in inputs:
+            png = os.path.join(plotdata.plotdir, "%sfig%s.png" % (prefix, figure.figno))
+            keys[png] = make_key(figure_keys[figure.figno], file_stamp(path))
+            if not manifest.is_current(png, keys[png]):
+                todo.setdefault(int(prefix[5:]), []).append(figure.figno)
+                stale.add(png)
+    return frames, gauges, keys, stale
+
+
+def draw(plotdata, frames, gauges):
+    """Draws the given figures of each frame and gauge into plotdata.plotdir
+
+    :param plotdata: ClawPlotData set up by setplot
+    :param dict frames: frame numbers with the figure numbers to draw
+    :param dict gauges: gauge numbers with the figure numbers to draw
+    """
+    from clawpack.visclaw import frametools, gaugetools
+
+    shown = {name: figure.show for (name, figure) in plotdata.plotfigure_dict.items()}
+    plotdata._mode = "printframes"
+    cwd = os.getcwd()
+    os.chdir(plotdata.plotdir)
+    try:
+        for (plot, todo) in [(frametools.plotframe, frames), (gaugetools.plotgauge, gauges)]:
+            for (number, fignos) in sorted(todo.items()):
+                # Only the outdirs of the shown figures are read
+                for (name, figure) in plotdata.plotfigure_dict.items():
+                    figure.show = shown[name] and figure.figno in fignos
+                frametools.set_show(plotdata)
+                plot(number, plotdata)
+    finally:
+        for (name, figure) in plotdata.plotfigure_dict.items():
+            figure.show = shown[name]
+        frametools.set_show(plotdata)
+        os.chdir(cwd)
+
+
+def index(plotdata, movies=False):
+    """Makes the HTML and LaTeX index pages (and movies) from the PNGs in plotdata.plotdir, without drawing
+
+    :param plotdata: ClawPlotData set up by setplot
+    :param bool movies: also make the movies setplot asks for, which reads all PNGs again
+    """
+    from clawpack.visclaw import plotpages
+
+    if not movies:
+        plotdata.html_movie = None
+        plotdata.mp4_movie = False
+        plotdata.gif_movie = False
+    # Finishing a parallel run of plotclaw makes the index pages from existing PNGs, without removing them first
+    plotdata.parallel = True
+    plotdata.num_procs = 2
+    plotdata._parallel_todo = "finalize"
+    plotdata.printfigs = False
+    plotpages.plotclaw_driver(plotdata, format=plotdata.format)
+
+
+def plot(outdir="_output", plotdir="_plots", setplot="setplot.py", movies=False):
+    """Draws the PNGs that are missing or out of date and makes the index pages
+
+    :param str outdir: output directory of the run
+    :param str plotdir: plot directory, PNGs drawn before are kept
+    :param str setplot: path to setplot.py
+    :param bool movies: also make the movies setplot asks for
+    :return: the number of PNGs that were out of date
+    """
+    from clawpack.visclaw.data import ClawPlotData
+    from clawpack.visclaw import frametools
+
+    plotdata = ClawPlotData()
+    plotdata.outdir = os.path.abspath(outdir)
+    plotdata.plotdir = os.path.abspath(plotdir)
+    plotdata = frametools.call_setplot(setplot, plotdata)
+    if not os.path.exists(plotdata.plotdir):
+        os.makedirs(plotdata.plotdir)
+
+    manifest = Manifest(os.path.join(plotdata.plotdir, "plots.json"))
+    frames, gauges, keys, stale = stale_plots(plotdata, manifest)
+    print("Drawing %s of %s PNGs (%s frames, %s gauges)" % (len(stale), len(keys), len(frames), len(gauges)))
+    start = time.time()
+    draw(plotdata, frames, gauges)
+
+    # PNGs that failed to draw stay out of date
+    for png in stale:
+        if os.path.exists(png) and os.path.getmtime(png) >= start:
+            manifest.record(png, keys[png])
+    manifest.save()
+
+    if plotdata.html or plotdata.latex:
+        index(plotdata, movies)
+    return len(stale)
+
+
+if __name__ == '__main__':
+    outdir = sys.argv[1] if len(sys.argv) > 1 else "_output"
+    plotdir = sys.argv[2] if len(sys.argv) > 2 else "_plots"
+    plot(outdir, plotdir)
@@ -0,0 +1,343 @@
+"""
+Caching of the input files generated by setrun.
+
+Each kind of generated file is recorded in a JSON manifest in the scratch directory together with the key of the
+inputs it was made from, so setrun can reuse it as long as neither the inputs nor the file itself changed.
+"""
+
+import os
+import json
+import time
+import gzip
+import shutil
+import hashlib
+
+import numpy as np
+
+from clawpack.amrclaw import region_tools
+from clawpack.geoclaw import topotools
+from clawpack.geoclaw.surge.storm import Storm
+
+from kml2slu import kml2slu
+
+
+scratch_dir = os.path.join(os.getcwd(), 'scratch')
+
+
+def file_hash(path, chunk_size=2 ** 20):
+    """Returns the sha256 hex digest of a file, read in chunks
+
+    :param str path: path to the file
+    :param int chunk_size: number of bytes read at a time
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def make_key(*parts):
+    """Returns a hex digest identifying the given json serializable parts"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def file_stamp(path):
+    """Returns the size and modification time of a file, used to notice generated files changed by hand"""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Manifest(object):
+    """Records which inputs each generated file was made from
+
+    :param str path: path to the .json manifest, created on the first save
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(path):
+            with open(path, "r") as manifest_file:
+                self.entries = json.load(manifest_file)
+
+    def is_current(self, output, key):
+        """Checks whether output exists, is unchanged and was made from the inputs identified by key
+
+        :param str output: path to the generated file
+        :param str key: key of the inputs, see make_key
+        """
+        entry = self.entries.get(os.path.abspath(output))
+        current = (entry is not None and entry["key"] == key and os.path.exists(output)
+                   and entry["stamp"] == file_stamp(output))
+        if current:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return current
+
+    def record(self, output, key, **info):
+        """Records that output was made from the inputs identified by key
+
+        :param str output: path to the generated file
+        :param str key: key of the inputs, see make_key
+        :param info: extra json serializable information to store with the entry
+        """
+        entry = dict(info, key=key, stamp=file_stamp(output))
+        self.entries[os.path.abspath(output)] = entry
+
+    def get(self, output):
+        """Returns the recorded entry of output, or None"""
+        return self.entries.get(os.path.abspath(output))
+
+    def save(self):
+        # Written to a temporary file first so an interrupted run never leaves a truncated manifest
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as manifest_file:
+            json.dump(self.entries, manifest_file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def report(self, label):
+        print("%s cache: %s hits, %s misses" % (label, self.hits, self.misses))
+
+
+def ruled_rectangles(kml_file, names, ixy='y', method=1, cache_dir=scratch_dir, out_dir=os.getcwd()):
+    """Writes RuledRectangle_<name>.data files for polygons drawn in Google Earth, reusing unchanged ones
+
+    Files are keyed on the content hash of the .kml file, the polygon name, ixy and method. The slus of each version of
+    the .kml file are kept in cache_dir, so the .kml file is only parsed when one of its polygons is missing there.
+
+    :param str kml_file: path to .kml file downloaded from Google Earth, see kml2slu
+    :param names: names of the polygons to write
+    :param str ixy: RuledRectangle ixy, 'x' or 'y'
+    :param int method: RuledRectangle method, 0 or 1
+    :param str cache_dir: directory holding the manifest and cached slus
+    :param str out_dir: directory the .data files are written to
+    :return: a dictionary of polygon names with the absolute paths of their .data files
+    """
+    kml_hash = file_hash(kml_file)
+    slu_path = os.path.join(cache_dir, "slu_%s.npz" % kml_hash[:16])
+    manifest = Manifest(os.path.join(cache_dir, "ruled_rectangles.json"))
+
+    slus = None
+    paths = {}
+    for name in names:
+        path = os.path.abspath(os.path.join(out_dir, 'RuledRectangle_%s.data' % name))
+        paths[name] = path
+        key = make_key(kml_hash, name, ixy, method)
+        if manifest.is_current(path, key):
+            continue
+
+        if slus is None:
+            if os.path.exists(slu_path):
+                slus = dict(np.load(slu_path))
+            else:
+                slus = kml2slu(kml_file)
+                np.savez(slu_path, **slus)
+        if name not in slus:
+            raise ValueError("Polygon %s not found in %s" % (name, kml_file))
+
+        rr = region_tools.RuledRectangle(slu=slus[name])
+        rr.ixy = ixy
+        rr.method = method
+        rr.write(path)
+        manifest.record(path, key, kml_file=os.path.abspath(kml_file), name=name)
+
+    if manifest.misses:
+        manifest.save()
+    manifest.report("RuledRectangle")
+    return paths
+
+
+def fgmax_points(rr_path, dx, out_path, cache_dir=scratch_dir):
+    """Writes the fgmax points inside a RuledRectangle, unless already done
+
+    The points are the cell centers of a grid with spacing dx over the bounding box of the RuledRectangle, written as a
+    topotype 3 file holding 1 inside and 0 outside, as GeoClaw reads fgmax grids with point_style 4.
+
+    :param str rr_path: path to the RuledRectangle .data file
+    :param float dx: grid spacing in degrees
+    :param str out_path: path of the topotype 3 file to write
+    :param str cache_dir: directory holding the manifest
+    :return: path of the points file
+    """
+    key = make_key(file_hash(rr_path), dx)
+
+    manifest = Manifest(os.path.join(cache_dir, "fgmax.json"))
+    if not manifest.is_current(out_path, key):
+        rr = region_tools.RuledRectangle(rr_path)
+        x1, x2, y1, y2 = rr.bounding_box()
+        topo = topotools.Topography()
+        topo.x = np.arange(x1 + dx / 2, x2, dx)
+        topo.y = np.arange(y1 + dx / 2, y2, dx)
+        X, Y = np.meshgrid(topo.x, topo.y)
+        topo.Z = np.where(rr.mask_outside(X, Y), 0, 1)
+        topo.write(out_path, topo_type=3, Z_format='%1i')
+        manifest.record(out_path, key, source=os.path.abspath(rr_path), dx=dx, points=int(topo.Z.sum()))
+        manifest.save()
+    manifest.report("fgmax points %s" % os.path.basename(out_path))
+    return out_path
+
+
+def crop_netcdf_topo(nc_path, extent, out_path=None, topo_type=3, no_data_value=-32767, header_style="asc",
+                     Z_format="%.0f", hash_source=False, cache_dir=scratch_dir):
+    """Crops a netCDF topography file to extent and writes it as a GeoClaw topofile, unless already done
+
+    The conversion is skipped when the recorded source file (by size and mtime, or content hash), extent and format
+    options all match those of the existing output file.
+
+    :param str nc_path: path to the netCDF topography file
+    :param list extent: [x1, x2, y1, y2] to crop to
+    :param str out_path: path of the topofile to write, by default named after nc_path and extent so that several
+            tiles of the same source can be kept side by side
+    :param int topo_type: GeoClaw topo_type of the output
+    :param no_data_value: value used to indicate missing data
+    :param str header_style: header style of the output, see topotools.Topography.write
+    :param str Z_format: format of the Z values written in ASCII topofiles
+    :param bool hash_source: identify the source by its sha256 instead of size and mtime
+    :param str cache_dir: directory holding the manifest
+    :return: path of the topofile
+    """
+    if out_path is None:
+        out_path = "%s_%s.asc" % (os.path.splitext(nc_path)[0], "_".join("%g" % e for e in extent))
+
+    source = file_hash(nc_path) if hash_source else file_stamp(nc_path)
+    key = make_key(os.path.abspath(nc_path), source, list(extent), topo_type, no_data_value, header_style, Z_format)
+
+    manifest = Manifest(os.path.join(cache_dir, "topo.json"))
+    if not manifest.is_current(out_path, key):
+        topotools.read_netcdf(nc_path, extent=extent, verbose=True).write(
+            out_path, topo_type=topo_type, no_data_value=no_data_value, header_style=header_style, Z_format=Z_format)
+        manifest.record(out_path, key, source=os.path.abspath(nc_path), extent=list(extent))
+        manifest.save()
+    manifest.report("Topography %s" % os.path.basename(out_path))
+    return out_path
+
+
+def write_netcdf_topo(topo, path, dtype="f4", no_data_value=-32767):
+    """Writes topography as a compressed topotype 4 (netCDF) file
+
+    Same layout as topotools.Topography.write with topo_type=4, but the elevation is stored with the given dtype and
+    zlib compression, which GeoClaw reads directly (it needs to be compiled with NETCDF, see the Makefile).
+
+    :param topo: topotools.Topography to write
+    :param str path: path of the .nc file
+    :param str dtype: netCDF type of the elevation, e.g. 'f4', or 'i2' for topography in whole meters
+    :param no_data_value: value used to indicate missing data
+    """
+    import netCDF4
+
+    Z = np.ma.filled(topo.Z, no_data_value)
+    if np.dtype(dtype).kind == "i":
+        Z = np.round(Z)
+
+    with netCDF4.Dataset(path, "w") as outfile:
+        outfile.Conventions = "CF-1.6"
+        outfile.title = "Topography Data"
+        outfile.comment = "Created by GeoClaw"
+
+        outfile.createDimension("lon", topo.x.shape[0])
+        outfile.createDimension("lat", topo.y.shape[0])
+
+        lon = outfile.createVariable("lon", "f8", ("lon",))
+        lon.standard_name = "longitude"
+        lon.units = "degrees_east"
+        lon.axis = "X"
+        lon[:] = topo.x
+
+        lat = outfile.createVariable("lat", "f8", ("lat",))
+        lat.standard_name = "latitude"
+        lat.units = "degrees_north"
+        lat.axis = "Y"
+        lat[:] = topo.y
+
+        elevation = outfile.createVariable("elevation", dtype, ("lat", "lon"), zlib=True)
+        elevation.units = "m"
+        elevation.positive = "up"
+        elevation.no_data_value = no_data_value
+        elevation[:, :] = Z
+
+
+def convert_topo(src_path, out_path=None, src_topo_type=3, dtype="f4", no_data_value=-32767, protected_paths=(),
+                 cache_dir=scratch_dir):
+    """Converts an ASCII topofile to a compressed topotype 4 (netCDF) file, unless already done
+
+    Reports the size and load time of both files. The load times are measured with topotools and stored in the
+    manifest, so they are reported again on later runs without reading the files.
+
+    :param str src_path: path to the topofile to convert
+    :param str out_path: path of the .nc file, defaults to src_path with the extension replaced by _topo4.nc, so that it
+            never takes the name of a netCDF source such as the CRM file the .asc tile was cropped from
+    :param int src_topo_type: GeoClaw topo_type of src_path
+    :param str dtype: netCDF type of the elevation, see write_netcdf_topo
+    :param no_data_value: value used to indicate missing data
+    :param list protected_paths: files that must not be overwritten, such as the downloaded inputs of prefetch
+    :param str cache_dir: directory holding the manifest
+    :return: path of the .nc file
+    """
+    if out_path is None:
+        out_path = os.path.splitext(src_path)[0] + "_topo4.nc"
+    protected = {os.path.abspath(path) for path in list(protected_paths) + [src_path]}
+    if os.path.abspath(out_path) in protected:
+        raise ValueError("Converting %s to %s would overwrite an input" % (src_path, out_path))
+
+    key = make_key(os.path.abspath(src_path), file_stamp(src_path), src_topo_type, dtype, no_data_value)
+
+    manifest = Manifest(os.path.join(cache_dir, "topo.json"))
+    if not manifest.is_current(out_path, key):
+        tic = time.time()
+        topo = topotools.Topography(src_path, topo_type=src_topo_type)
+        src_load_time = time.time() - tic
+
+        write_netcdf_topo(topo, out_path, dtype=dtype, no_data_value=no_data_value)
+        del topo
+
+        tic = time.time()
+        topotools.Topography(out_path, topo_type=4)
+        out_load_time = time.time() - tic
+
+        manifest.record(out_path, key, source=os.path.abspath(src_path), source_size=os.path.getsize(src_path),
+                        source_load_time=src_load_time, load_time=out_load_time)
+        manifest.save()
+
+    entry = manifest.get(out_path)
+    print("%s: %.1f MB, loaded in %.2f s -> %s: %.1f MB, loaded in %.2f s"
+          % (os.path.basename(src_path), entry["source_size"] / 1e6, entry["source_load_time"],
+             os.path.basename(out_path), entry["stamp"][0] / 1e6, entry["load_time"]))
+    manifest.report("Topography %s" % os.path.basename(out_path))
+    return out_path
+
+
+def atcf2storm(gz_path, storm_path, time_offset, chunk_size=2 ** 20, cache_dir=scratch_dir):
+    """Converts a gzipped ATCF file to a GeoClaw storm file, unless already done
+
+    The .gz file is decompressed next to itself in chunks of chunk_size bytes, then parsed and written as a GeoClaw
+    storm file. All three steps are skipped when the checksum of the .gz file and time_offset match the ones the
+    existing storm file was made from.
+
+    :param str gz_path: path to the gzipped ATCF file
+    :param str storm_path: path of the GeoClaw storm file
+    :param datetime time_offset: time of landfall, see Storm.time_offset
+    :param int chunk_size: number of bytes decompressed at a time
+    :param str cache_dir: directory holding the manifest
+    :return: path of the storm file
+    """
+    key = make_key(file_hash(gz_path), time_offset.isoformat())
+
+    manifest = Manifest(os.path.join(cache_dir, "storm.json"))
+    if not manifest.is_current(storm_path, key):
+        # Note that the get_remote_file function does not support gzip files which
+        # are not also tar files.  The following code handles this
+        atcf_path = os.path.splitext(gz_path)[0]
+        with gzip.open(gz_path, 'rb') as atcf_file, open(atcf_path, 'wb') as atcf_unzipped_file:
+            shutil.copyfileobj(atcf_file, atcf_unzipped_file, chunk_size)
+
+        storm = Storm(path=atcf_path, file_format="ATCF")
+        storm.time_offset = time_offset
+        storm.write(storm_path, file_format='geoclaw')
+        manifest.record(storm_path, key, source=os.path.abspath(gz_path), time_offset=time_offset.isoformat())
+        manifest.save()
+    manifest.report("Storm %s" % os.path.basename(storm_path))
+    return storm_path
@@ -1,95 +1,153 @@
-# work on increasing efficiency
+import zipfile
+from xml.etree import ElementTree
 
 import numpy as np
-import pandas as pd
 
-pd.options.mode.chained_assignment = None  # default='warn'
+# Max number of (vertex, segment) pairs evaluated at once, bounds memory for polygons with many vertices
+chunk_size = 2 ** 20
+
+
+def polygon2slu(lon, lat):
+    """Converts the vertices of one closed polygon to slu format
+
+    :param ndarray lon: longitudes of the polygon vertices, in order
+    :param ndarray lat: latitudes of the polygon vertices, in order
+    :return: the slu as an ndarray of [lat, lon 0, lon 1] rows sorted by latitude, and a list of the latitudes
+            where three points of the polygon were found
+    """
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+
+    # Polygon segments from each vertex to the next
+    x, y = lon[:-1], lat[:-1]
+    ylower = np.minimum(lat[:-1], lat[1:])
+    yupper = np.maximum(lat[:-1], lat[1:])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (lat[1:] - lat[:-1]) / (lon[1:] - lon[:-1])
+
+    # For each vertex, the first crossing of its latitude with another segment and the number of such crossings
+    found = np.full(len(lat), np.nan)
+    crossings = np.zeros(len(lat), dtype=int)
+    step = max(1, chunk_size // max(1, len(x)))
+    for start in range(0, len(lat), step):
+        lat_c = lat[start:start + step, np.newaxis]
+        lon_c = lon[start:start + step, np.newaxis]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lons = ((lat_c - y) / slope) + x
+        hits = (ylower <= lat_c) & (lat_c <= yupper) & (lons != lon_c)
+        crossings[start:start + step] = hits.sum(axis=1)
+        first = hits.argmax(axis=1)
+        found[start:start + step] = lons[np.arange(len(first)), first]
+
+    # Top and bottom vertices do not cross another segment
+    found = np.where(crossings > 0, found, lon)
+    lon0 = np.where(found > lon, lon, found)
+    lon1 = np.where(found > lon, found, lon)
+
+    # Found three points with same latitude
+    threats = [str(lat_t) for lat_t in np.repeat(lat, np.maximum(crossings - 1, 0))]
+
+    # First vertex of each latitude, sorted by latitude
+    lats, first = np.unique(lat, return_index=True)
+    return np.column_stack([lats, lon0[first], lon1[first]]), threats
+
+
+def _local(tag):
+    # Strips the namespace from an ElementTree tag
+    return tag.rpartition("}")[2]
+
+
+def _coordinates(text):
+    # Parses the text of a <coordinates> element, in any layout, to arrays of lon and lat
+    coords = np.array([point.split(",")[:2] for point in text.split()], dtype=float).reshape(-1, 2)
+    return coords[:, 0], coords[:, 1]
+
+
+def iter_polygons(file):
+    """Streams the polygons of a .kml or .kmz file one Placemark at a time
+
+    Placemarks are parsed incrementally and discarded once yielded, so memory is bounded by the largest Placemark
+    rather than the size of the file. Only the outer boundary of each polygon is used, inner boundaries (holes) can not
+    be represented by a slu. A Placemark holding several polygons in a MultiGeometry yields them as name, name_2, ...
+
+    :param str file: path to .kml file, or zipped .kmz file, downloaded from Google Earth
+    :return: generator of (name, lon, lat) for each polygon, with lon and lat as ndarrays
+    """
+    if zipfile.is_zipfile(file):
+        with zipfile.ZipFile(file) as kmz:
+            members = [m for m in kmz.namelist() if m.lower().endswith(".kml")]
+            if not members:
+                raise ValueError("%s does not contain a .kml file" % file)
+            member = "doc.kml" if "doc.kml" in members else members[0]
+            with kmz.open(member) as kml_file:
+                yield from _iter_placemarks(kml_file)
+    else:
+        with open(file, "rb") as kml_file:
+            yield from _iter_placemarks(kml_file)
+
+
+def _iter_placemarks(kml_file):
+    stack = []
+    placemarks = 0
+    depth = None  # depth of the Placemark being read
+    for event, elem in ElementTree.iterparse(kml_file, events=("start", "end")):
+        if event == "start":
+            if depth is None and _local(elem.tag) == "Placemark":
+                depth = len(stack)
+            stack.append(elem)
+            continue
+
+        stack.pop()
+        if depth is not None and len(stack) > depth:
+            # Still inside the Placemark, which is processed as a whole at its end
+            continue
+
+        if depth is not None:
+            depth = None
+            placemarks += 1
+            name = next((child.text.strip() for child in elem
+                         if _local(child.tag) == "name" and child.text), "Placemark %d" % placemarks)
+            polygons = [poly for poly in elem.iter() if _local(poly.tag) == "Polygon"]
+            for num, poly in enumerate(polygons, 1):
+                for boundary in poly:
+                    if _local(boundary.tag) != "outerBoundaryIs":
+                        continue
+                    text = "".join(coords.text or "" for coords in boundary.iter()
+                                   if _local(coords.tag) == "coordinates")
+                    lon, lat = _coordinates(text)
+                    yield (name if num == 1 else "%s_%d" % (name, num)), lon, lat
+
+        # Drop everything already read to keep memory bounded
+        if stack:
+            stack[-1].remove(elem)
+
+
+def iter_slus(file):
+    """Streams the slus of the polygons in a .kml or .kmz file
+
+    :param str file: path to .kml file, or zipped .kmz file, downloaded from Google Earth
+    :return: generator of (name, slu, threats) for each polygon, see polygon2slu
+    """
+    for name, lon, lat in iter_polygons(file):
+        slu, threats = polygon2slu(lon, lat)
+        yield name, slu, threats
 
 
 def kml2slu(file, write=False):
     """Converts Polygons drawn in Google Earth to slu used by GeoClaw flag_regions
 
-    :param str file: path to .kml file downloaded from Google Earth
+    :param str file: path to .kml file, or zipped .kmz file, downloaded from Google Earth
             - there must not be any three points on the polygon with the same latitude
     :param bool write: will write slus to a .txt file named slu_outputs
     :return: a dictionary of polygon names with their slus in ndarray format
     """
-    class Segment:
-        # Stores info needed for each line segment making up the polygon
-        def __init__(self, x0, x1, y0, y1):
-            self.x = x0
-            self.y = y0
-            self.ylower = np.min([y0, y1])
-            self.yupper = np.max([y0, y1])
-            self.slope = (y1 - y0) / (x1 - x0)
-
     polygons = {}
-
-    placemark = False
-    name = None
-    polygon = False
-    grab_next = False
-
     threats = []
 
-    with open(file, "r") as kml_file:
-        for num, line in enumerate(kml_file, 1):
-            if "<Placemark>" in line:
-                placemark = True
-
-            elif placemark:
-                if "<name>" in line:
-                    name = line[line.find(">") + 1:line.find("</")]
-                elif "<Polygon>" in line:
-                    polygon = True
-                elif ("<coordinates>" in line) and polygon:
-                    grab_next = True
-                elif grab_next:
-                    tmp_threats = ["\n" + name]
-                    # Grabs coordinates of points and puts them in dataframe with [lat, lon]
-                    s = pd.Series(np.array(line.strip().split(" "))).str.split(",")
-                    df = pd.concat([s.str.get(0).astype(float), s.str.get(1).astype(float)], axis=1)
-                    df.columns = ["lon", "lat"]
-
-                    # Identify polygon segments
-                    segments = [
-                        Segment(df["lon"].iloc[i], df["lon"].iloc[i + 1], df["lat"].iloc[i], df["lat"].iloc[i + 1])
-                        for i in df.index.to_list() if i != len(df) - 1]
-
-                    # Get longitudes for each latitude
-                    df["lon 0"] = None
-                    df["lon 1"] = None
-                    for i in df.index.to_list():
-                        lat = df["lat"].iloc[i]
-                        lon_orig = df["lon"].iloc[i]
-                        for segment in segments:
-                            if segment.ylower <= lat <= segment.yupper:
-                                lon = ((lat - segment.y) / segment.slope) + segment.x
-                                if lon != lon_orig:
-                                    if df["lon 0"].iloc[i] is not None:
-                                        # Found three points with same latitude
-                                        tmp_threats.append(str(lat))
-                                    elif lon > lon_orig:
-                                        df["lon 1"].iloc[i] = lon
-                                        df["lon 0"].iloc[i] = lon_orig
-                                    else:
-                                        df["lon 1"].iloc[i] = lon_orig
-                                        df["lon 0"].iloc[i] = lon
-
-                        # For top and bottom verticies
-                        if df["lon 0"].iloc[i] is None and df["lon 1"].iloc[i] is None:
-                            df["lon 0"].iloc[i] = lon_orig
-                            df["lon 1"].iloc[i] = lon_orig
-
-                    polygons[name] = df[["lat", "lon 0", "lon 1"]].drop_duplicates(subset=['lat']).sort_values(
-                        by=['lat']).reset_index(drop=True).to_numpy()
-
-                    if len(tmp_threats) > 1:
-                        threats += tmp_threats
-
-                    polygon = False
-                    grab_next = False
-                    placemark = False
+    for name, slu, tmp_threats in iter_slus(file):
+        polygons[name] = slu
+        if tmp_threats:
+            threats += ["\n" + name] + tmp_threats
 
     if threats:
         raise TypeError("The following polygons have three points with the same latitude. Each latitude "
@@ -0,0 +1,275 @@
+"""
+Live view of the gauges while a run is going.
+
+Each gauge file in _output is followed like tail -f: only the rows GeoClaw appended since the last look are parsed, and
+only the latest surface, the peak so far and the arrival time of the surge are kept, so memory stays the same however
+long the run is. The files are only opened for reading and never locked, and a row is only used once its line is
+complete, so the run is not disturbed.
+
+    python monitor.py [outdir] [--gauges 2,3] [--interval 10] [--http 8000]
+
+refreshes a table of the gauges in the console every interval seconds, or with --http serves it as JSON at
+http://localhost:8000/ instead.
+"""
+
+import os
+import sys
+import json
+import time
+import datetime
+import threading
+
+import numpy as np
+
+import gauges
+import observations
+
+
+class GaugeTail(object):
+    """Running state of a gauge file that is still being written
+
+    :param str path: path to gaugeNNNNN.txt
+    :param float arrival_tol: surface elevation (m) at which the surge is considered to have arrived
+    """
+
+    def __init__(self, path, arrival_tol=0.5):
+        self.path = path
+        self.arrival_tol = arrival_tol
+        self.reset()
+
+    def reset(self):
+        """Forgets the rows read, e.g. when the run was started again"""
+        self.offset = 0
+        self.data_path = None
+        self.row_size = None
+        self.rows = 0
+        self.t = np.nan
+        self.eta = np.nan
+        self.peak = np.nan
+        self.peak_time = np.nan
+        self.arrival_time = np.nan
+
+    def _read_header(self, text):
+        # Finds the end of the header, which GeoClaw ends with the file format line, and the .bin file of binary
+        # gauges. Returns False while the header is incomplete
+        end = 0
+        for line in text.splitlines(True):
+            if not line.startswith("#") or not line.endswith("\n"):
+                return False
+            end += len(line)
+            if "file format" in line:
+                if "binary" in line:
+                    num_var = int(text.split("\n", 1)[0].split()[-1])
+                    self.data_path = os.path.splitext(self.path)[0] + ".bin"
+                    self.row_size = (2 + num_var) * (4 if "binary32" in line else 8)
+                self.offset = 0 if "binary" in line else end
+                return True
+        return False
+
+    def _update(self, t, eta):
+        # Takes in new rows of time and surface
+        if t.size == 0:
+            return
+        self.rows += t.size
+        self.t, self.eta = t[-1], eta[-1]
+        peak = np.argmax(eta)
+        if not eta[peak] <= self.peak:
+            self.peak, self.peak_time = eta[peak], t[peak]
+        arrived = eta >= self.arrival_tol
+        if np.isnan(self.arrival_time) and arrived.any():
+            self.arrival_time = t[np.argmax(arrived)]
+
+    def poll(self):
+        """Reads the rows appended since the last poll
+
+        :return: the number of new rows
+        """
+        rows = self.rows
+        if self.data_path is None and self.offset == 0:
+            with open(self.path, "r") as gauge_file:
+                if not self._read_header(gauge_file.read(4096)):
+                    return 0
+
+        path = self.data_path or self.path
+        # The header of a gauge file written again from the start is shorter than the rows read before
+        if not os.path.exists(path):
+            return 0
+        if os.path.getsize(path) < self.offset:
+            # The file was written again from the start
+            self.reset()
+            return self.poll()
+
+        with open(path, "rb") as data_file:
+            data_file.seek(self.offset)
+            chunk = data_file.read()
+        if self.row_size is not None:
+            # Whole rows of the binary file only
+            chunk = chunk[:len(chunk) - len(chunk) % self.row_size]
+            self.offset += len(chunk)
+            data = np.frombuffer(chunk, dtype=np.float32 if self.row_size % 8 else np.float64)
+            data = data.reshape((-1, self.row_size // data.itemsize)).astype(float)
+        else:
+            # Complete lines only, a partly written last line is read at the next poll
+            chunk = chunk[:chunk.rfind(b"\n") + 1]
+            self.offset += len(chunk)
+            lines = [line for line in chunk.decode().splitlines() if line.strip() and not line.startswith("#")]
+            data = np.array(" ".join(lines).replace("D", "E").split(), dtype=float)
+            data = data.reshape((len(lines), -1)) if lines else data.reshape((0, len(gauges.columns)))
+        self._update(data[:, gauges.columns.index("t")], data[:, gauges.columns.index("eta")])
+        return self.rows - rows
+
+    def state(self, landfall=gauges.landfall_date):
+        """Running state of the gauge
+
+        :param datetime landfall: landfall time the gauge times are relative to
+        :return: a dictionary with the number of "rows" read, the latest time "t" in seconds relative to landfall and
+                surface "eta", the "peak" surface so far with its "peak_time" and "peak_date", and the "arrival_time"
+                (None where there is no value yet)
+        """
+        def value(number):
+            return None if np.isnan(number) else float(number)
+
+        return {"rows": self.rows,
+                "t": value(self.t),
+                "eta": value(self.eta),
+                "peak": value(self.peak),
+                "peak_time": value(self.peak_time),
+                "peak_date": None if np.isnan(self.peak_time) else
+                (landfall + datetime.timedelta(seconds=float(self.peak_time))).isoformat(),
+                "arrival_time": value(self.arrival_time)}
+
+
+class GaugeMonitor(object):
+    """Follows the gauge files of a run, including those that only appear after it started
+
+    :param str outdir: output directory of the run
+    :param list gaugenos: gauges to follow, defaults to all
+    :param float arrival_tol: see GaugeTail
+    """
+
+    def __init__(self, outdir="_output", gaugenos=None, arrival_tol=0.5):
+        self.outdir = outdir
+        self.gaugenos = gaugenos
+        self.arrival_tol = arrival_tol
+        self.tails = {}
+        self.lock = threading.Lock()
+
+    def poll(self):
+        """Reads the new rows of all gauges
+
+        :return: the number of new rows
+        """
+        rows = 0
+        with self.lock:
+            for (gaugeno, path) in gauges.gauge_files(self.outdir).items():
+                if self.gaugenos is None or gaugeno in self.gaugenos:
+                    rows += self.tails.setdefault(gaugeno, GaugeTail(path, self.arrival_tol)).poll()
+        return rows
+
+    def states(self):
+        """Running states of the gauges, see GaugeTail.state, with the "station" name of each gauge"""
+        with self.lock:
+            states = {}
+            for (gaugeno, tail) in sorted(self.tails.items()):
+                states[gaugeno] = tail.state()
+                states[gaugeno]["station"] = (observations.stations[gaugeno - 1][1]
+                                              if 0 < gaugeno <= len(observations.stations) else None)
+            return states
+
+
+def format_states(states):
+    """Table of the gauge states for the console"""
+    def hours(seconds):
+        return "" if seconds is None else "%+.2f h" % (seconds / 3600.0)
+
+    def meters(value):
+        return "" if value is None else "%.3f m" % value
+
+    lines = ["%-6s %-40s %8s %10s %10s %10s %10s" % ("Gauge", "Station", "Rows", "t", "Surface", "Peak",
+                                                      "Peak time")]
+    for (gaugeno, state) in states.items():
+        lines.append("%-6s %-40s %8s %10s %10s %10s %10s" % (gaugeno, state["station"] or "", state["rows"],
+                                                             hours(state["t"]), meters(state["eta"]),
+                                                             meters(state["peak"]), hours(state["peak_time"])))
+        if state["arrival_time"] is not None:
+            lines[-1] += "  arrived %s" % hours(state["arrival_time"])
+    return "\n".join(lines)
+
+
+def watch(monitor, interval=10.0, stop=None):
+    """Refreshes the table of the gauges in the console until interrupted or stop is set
+
+    :param GaugeMonitor monitor: gauges to follow
+    :param float interval: seconds between refreshes
+    :param threading.Event stop: set to stop watching
+    """
+    stop = threading.Event() if stop is None else stop
+    while not stop.is_set():
+        monitor.poll()
+        # Clear the terminal and write the table from the top
+        sys.stdout.write("\033[2J\033[H%s\n\n%s  (every %s s, Ctrl-C to stop)\n" % (
+            format_states(monitor.states()), time.strftime("%H:%M:%S"), interval))
+        sys.stdout.flush()
+        stop.wait(interval)
+
+
+def serve(monitor, port=8000, interval=10.0):
+    """Serves the states of the gauges as JSON on localhost, polling the gauge files every interval seconds
+
+    :param GaugeMonitor monitor: gauges to follow
+    :param int port: port of http://localhost:<port>/
+    :param float interval: seconds between polls
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps({"outdir": os.path.abspath(monitor.outdir), "updated": time.time(),
+                               "gauges": monitor.states()}, indent=2).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    stop = threading.Event()
+
+    def poll():
+        while not stop.is_set():
+            monitor.poll()
+            stop.wait(interval)
+
+    poller = threading.Thread(target=poll, daemon=True)
+    poller.start()
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    print("Serving the gauges of %s at http://localhost:%s/" % (monitor.outdir, port))
+    try:
+        server.serve_forever()
+    finally:
+        stop.set()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {}
+    for name in ["--gauges", "--interval", "--http"]:
+        if name in args:
+            index = args.index(name)
+            options[name] = args[index + 1]
+            del args[index:index + 2]
+    outdir = args[0] if args else "_output"
+    gaugenos = [int(gaugeno) for gaugeno in options["--gauges"].split(",")] if "--gauges" in options else None
+    interval = float(options.get("--interval", 10.0))
+
+    monitor = GaugeMonitor(outdir, gaugenos)
+    try:
+        if "--http" in options:
+            serve(monitor, int(options["--http"]), interval)
+        else:
+            watch(monitor, interval)
+    except KeyboardInterrupt:
+        pass
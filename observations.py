@@ -0,0 +1,121 @@
+"""
+Store of the observed surge at the NOAA Tides and Currents stations of the gauges.
+
+The water levels of each station are fetched once with geoutil.fetch_noaa_tide_data, the tide predictions are
+subtracted, and the de-tided observations are saved to a single .npz in the scratch directory. Every plotting process
+and comparison script loads that file once and reads the observations from memory afterwards.
+
+    python observations.py
+
+fetches any missing stations and prints the observed peak at each.
+"""
+
+import os
+import sys
+import datetime
+import warnings
+
+import numpy as np
+
+
+scratch_dir = os.path.join(os.getcwd(), 'scratch')
+
+# NOAA stations of gauges 1-5
+stations = [('8720218', 'Mayport (Bar Pilots Dock), FL'),
+            ('8670870', 'Fort Pulaski, GA'),
+            ('8665530', 'Charleston, Cooper River Entrance, SC'),
+            ('8658163', 'Wrightsville Beach, NC'),
+            ('8658120', 'Wilmington, NC')]
+
+landfall_time = np.datetime64('2016-10-08T12:00')
+begin_date = datetime.datetime(2016, 10, 6, 12)
+end_date = datetime.datetime(2016, 10, 9, 12)
+
+# Observations already loaded by this process, keyed by (station_id, begin_date, end_date)
+_observations = {}
+
+
+def store_path(begin_date=begin_date, end_date=end_date, cache_dir=scratch_dir):
+    """Path of the .npz holding the observations between begin_date and end_date"""
+    return os.path.join(cache_dir, "noaa_observations_%s_%s.npz" % (begin_date.strftime("%Y%m%d%H%M"),
+                                                                   end_date.strftime("%Y%m%d%H%M")))
+
+
+def load_observations(station_ids=None, begin_date=begin_date, end_date=end_date, cache_dir=scratch_dir):
+    """Loads the de-tided observations of several stations into memory
+
+    Stations missing from the .npz store are fetched from NOAA (through the text cache of fetch_noaa_tide_data in
+    cache_dir) and added to it.
+
+    :param list station_ids: NOAA station ids, defaults to the stations of all gauges
+    :param datetime begin_date: start of the observations
+    :param datetime end_date: end of the observations
+    :param str cache_dir: directory of the .npz store
+    :return: a dictionary of station ids with (date_time, surge) tuples, date_time being a datetime64 array and surge
+            the measured water level minus the tide prediction (m). Stations that could not be fetched are left out
+            with a warning
+    """
+    if station_ids is None:
+        station_ids = [station_id for (station_id, _) in stations]
+
+    missing = [station_id for station_id in station_ids
+               if (station_id, begin_date, end_date) not in _observations]
+    if missing:
+        path = store_path(begin_date, end_date, cache_dir)
+        arrays = {}
+        if os.path.exists(path):
+            with np.load(path) as store:
+                arrays = {name: store[name] for name in store.files}
+
+        fetched = False
+        for station_id in missing:
+            if station_id + "_t" not in arrays:
+                import clawpack.geoclaw.util as geoutil
+                fetched_data = geoutil.fetch_noaa_tide_data(station_id, begin_date, end_date, cache_dir=cache_dir)
+                if fetched_data is None or any(values is None for values in fetched_data):
+                    # No network or NOAA unavailable, tried again by the next process
+                    warnings.warn("Could not fetch the observations of station %s from NOAA, leaving it out" %
+                                  station_id)
+                    continue
+                date_time, water_level, prediction = fetched_data
+                arrays[station_id + "_t"] = date_time
+                arrays[station_id + "_surge"] = water_level - prediction
+                fetched = True
+
+        if fetched:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            # Written to a temporary file of this process first, so that other processes never load a partial store
+            # and parallel plotting processes never write to the same file
+            tmp_path = "%s.%s.tmp" % (path, os.getpid())
+            with open(tmp_path, "wb") as store_file:
+                np.savez(store_file, **arrays)
+            os.replace(tmp_path, path)
+
+        for station_id in missing:
+            if station_id + "_t" in arrays:
+                _observations[(station_id, begin_date, end_date)] = (arrays[station_id + "_t"],
+                                                                     arrays[station_id + "_surge"])
+
+    return {station_id: _observations[(station_id, begin_date, end_date)] for station_id in station_ids
+            if (station_id, begin_date, end_date) in _observations}
+
+
+def observed_surge(station_id, begin_date=begin_date, end_date=end_date, cache_dir=scratch_dir):
+    """De-tided observations of one station, see load_observations
+
+    :return: date_time as a datetime64 array and the surge (m), or None if the station could not be fetched
+    """
+    return load_observations([station_id], begin_date, end_date, cache_dir).get(station_id)
+
+
+if __name__ == '__main__':
+    cache_dir = sys.argv[1] if len(sys.argv) == 2 else scratch_dir
+    for (station_id, station_name) in stations:
+        observed = observed_surge(station_id, cache_dir=cache_dir)
+        if observed is None:
+            print("%s (%s):  no observations" % (station_name, station_id))
+            continue
+        date_time, surge = observed
+        peak = np.nanargmax(surge)
+        print("%s (%s):  surge = %.3f  date = %s" % (station_name, station_id, surge[peak], date_time[peak]))
@@ -0,0 +1,175 @@
+"""
+Prefetch of the remote input files used by setrun.
+
+All declared inputs are downloaded at the same time into the scratch directory. Interrupted downloads are resumed with
+HTTP range requests, and every file is checked against the size and sha256 recorded in scratch/prefetch.json (or
+declared below), so that setrun can run fully offline afterwards.
+
+    python prefetch.py      (or make prefetch)
+"""
+
+import os
+import sys
+import shutil
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+
+import inputcache
+
+
+scratch_dir = os.path.join(os.getcwd(), 'scratch')
+
+# Remote inputs, a "size" in bytes and/or "sha256" can be given to check the download against known values,
+# otherwise they are recorded on the first download and checked from then on
+inputs = [{"url": "https://www.dropbox.com/s/s58bi1l45tw9uka/gebco_2020_n50.0_s10.0_w-90.0_e-60.0.asc?dl=1",
+           "file_name": "gebco_2020_n50.0_s10.0_w-90.0_e-60.0.asc"},
+          {"url": "https://www.ngdc.noaa.gov/thredds/fileServer/crm/crm_vol2.nc",
+           "file_name": "crm_vol2_se_atl.nc"},
+          {"url": "https://ftp.nhc.noaa.gov/atcf/archive/2016/bal142016.dat.gz",
+           "file_name": "bal142016.dat.gz"}]
+
+
+def _download(url, part_path, chunk_size, timeout):
+    # Appends the remainder of url to part_path, returns the total size reported by the server (or None)
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    request = Request(url, headers={"Range": "bytes=%s-" % offset} if offset else {})
+    try:
+        response = urlopen(request, timeout=timeout)
+    except HTTPError as e:
+        if e.code == 416:
+            # Nothing left to download
+            return offset
+        raise
+
+    with response:
+        if response.status == 206:
+            total = response.headers.get("Content-Range", "").rpartition("/")[2]
+            mode = "ab"
+        else:
+            # Server ignored the range, start over
+            total = response.headers.get("Content-Length")
+            mode = "wb"
+        with open(part_path, mode) as part_file:
+            shutil.copyfileobj(response, part_file, chunk_size)
+    return int(total) if total and total.isdigit() else None
+
+
+def fetch(remote, output_dir=scratch_dir, manifest=None, verify_hash=True, chunk_size=2 ** 20, timeout=60,
+          retries=5):
+    """Downloads one remote input unless a verified copy already exists
+
+    :param dict remote: declared input with "url", "file_name" and optionally "size" and "sha256"
+    :param str output_dir: directory the file is stored in
+    :param manifest: inputcache.Manifest with the recorded size and sha256 of each file
+    :param bool verify_hash: also check the sha256 of existing files, not only their size
+    :param int chunk_size: number of bytes written at a time
+    :param int timeout: seconds to wait for the server
+    :param int retries: number of attempts to complete an interrupted download
+    :return: path of the local file
+    """
+    path = os.path.join(output_dir, remote["file_name"])
+    recorded = dict(manifest.get(path) or {}) if manifest is not None else {}
+    expected = {"size": remote.get("size", recorded.get("size")),
+                "sha256": remote.get("sha256", recorded.get("sha256"))}
+
+    def check(file_path, full):
+        size = os.path.getsize(file_path)
+        if expected["size"] is not None and size != expected["size"]:
+            return "size %s, expected %s" % (size, expected["size"])
+        if full and expected["sha256"] is not None and inputcache.file_hash(file_path) != expected["sha256"]:
+            return "sha256 does not match"
+        return None
+
+    def record():
+        if manifest is not None:
+            manifest.record(path, inputcache.make_key(remote["url"]), url=remote["url"], size=os.path.getsize(path),
+                            sha256=inputcache.file_hash(path))
+
+    if os.path.exists(path):
+        problem = check(path, verify_hash)
+        if problem is None:
+            if not recorded and verify_hash:
+                # Fetched before the manifest existed
+                record()
+            return path
+        print("%s is corrupt (%s), downloading again" % (path, problem))
+        os.remove(path)
+
+    # Whatever was downloaded before an interruption is kept in the .part file and resumed from
+    part_path = path + ".part"
+    for attempt in range(1, retries + 1):
+        print("Downloading %s to %s..." % (remote["url"], path))
+        try:
+            total = _download(remote["url"], part_path, chunk_size, timeout)
+        except (OSError, http.client.HTTPException) as e:
+            if attempt == retries:
+                raise
+            print("Download of %s interrupted (%s), resuming" % (remote["url"], e))
+            continue
+        if expected["size"] is None:
+            expected["size"] = total
+        if expected["size"] is None or os.path.getsize(part_path) >= expected["size"]:
+            break
+        print("Download of %s incomplete, resuming" % remote["url"])
+
+    problem = check(part_path, True)
+    if problem is not None:
+        os.remove(part_path)
+        raise IOError("Download of %s failed: %s" % (remote["url"], problem))
+    os.replace(part_path, path)
+    record()
+    return path
+
+
+def prefetch(remotes=None, output_dir=scratch_dir, verify_hash=True, max_workers=None, **kwargs):
+    """Fetches all remote inputs at the same time with a thread pool
+
+    :param list remotes: declared inputs, see fetch, defaults to inputs
+    :param str output_dir: directory the files are stored in
+    :param bool verify_hash: also check the sha256 of existing files, not only their size
+    :param int max_workers: number of simultaneous downloads, defaults to one per input
+    :param kwargs: passed on to fetch
+    :return: a dictionary of file names with their local paths
+    """
+    if remotes is None:
+        remotes = inputs
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    manifest = inputcache.Manifest(os.path.join(output_dir, "prefetch.json"))
+    lock = threading.Lock()
+
+    class LockedManifest(object):
+        # Serializes the updates of the download threads
+        changed = False
+
+        def get(self, path):
+            with lock:
+                return manifest.get(path)
+
+        def record(self, *args, **info):
+            with lock:
+                manifest.record(*args, **info)
+                self.changed = True
+
+    locked_manifest = LockedManifest()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers or len(remotes)) as pool:
+            futures = {remote["file_name"]: pool.submit(fetch, remote, output_dir, locked_manifest, verify_hash,
+                                                        **kwargs)
+                       for remote in remotes}
+            paths = {file_name: future.result() for (file_name, future) in futures.items()}
+    finally:
+        # Keep what was verified even if one of the downloads failed, the manifest is only written when it changed
+        if locked_manifest.changed:
+            manifest.save()
+    return paths
+
+
+if __name__ == '__main__':
+    # Fetch all inputs, checking the sha256 of any already in scratch
+    for (file_name, path) in prefetch(output_dir=sys.argv[1] if len(sys.argv) == 2 else scratch_dir).items():
+        print("%s: %s" % (file_name, path))
@@ -0,0 +1,183 @@
+"""
+Parallel rendering of the frame figures of setplot.
+
+With plotdata.parallel, setplot first extracts the subsets of the regional figures from every frame and writes them to
+disk (see frames.extract_regions), and visclaw then starts processes that each read the frame again from every output
+directory used by the figures, making every figure anew. Here setplot leaves the subsets to render, each frame is read
+once and the subsets of the regional figures are cut out of it in memory. The frames are spread over a pool of
+processes, one per available core, each of which keeps its figures and axes from one frame to the next and only clears
+them.
+
+    python render.py [outdir] [plotdir]      (or make rendered_plots)
+
+draws the frame and gauge figures of setplot into plotdir, makes the index pages and reports the frames drawn per
+second.
+"""
+
+import os
+import sys
+import time
+import multiprocessing
+
+import frames
+
+
+# Set up plot data of each rendering process, see setup
+_plotdata = None
+
+
+def setup(outdir="_output", plotdir="_plots", setplot="setplot.py"):
+    """Sets up the figures of setplot for rendering
+
+    :param str outdir: output directory of the run
+    :param str plotdir: directory the PNGs are written to
+    :param str setplot: path to setplot.py
+    :return: ClawPlotData set up by setplot, not printing the frame figures itself
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    from clawpack.visclaw.data import ClawPlotData
+    from clawpack.visclaw import frametools
+
+    plotdata = ClawPlotData()
+    plotdata.outdir = os.path.abspath(outdir)
+    plotdata.plotdir = os.path.abspath(plotdir)
+    # Filled by setplot with the extent of the regional subsets instead of extracting them, see read_solutions
+    plotdata._region_extents = {}
+    plotdata = frametools.call_setplot(setplot, plotdata, verbose=False)
+    plotdata._mode = "printframes"
+    frametools.set_show(plotdata)
+    plotdata.set_outdirs()
+    # Each frame is only drawn once, as in visclaw's plotclaw
+    plotdata.save_frames = False
+    # Frame figures are cleared and printed by render_frame
+    plotdata.printfigs = False
+    for figure in frame_figures(plotdata):
+        figure.clf_each_frame = False
+    return plotdata
+
+
+def frame_figures(plotdata):
+    """Figures of plotdata drawn for each frame"""
+    figures = [plotdata.plotfigure_dict[name] for name in plotdata._fignames]
+    return [figure for figure in figures if figure._show and figure.type == "each_frame"
+            and (plotdata.print_fignos == "all" or figure.figno in plotdata.print_fignos)]
+
+
+def read_solutions(plotdata, frameno):
+    """Reads a frame once for all figures
+
+    :param plotdata: ClawPlotData, see setup
+    :param int frameno: frame number
+    :return: the Solutions of plotdata._outdirs, the subsets of the regions (plotdata._region_extents) cut out of the
+            whole frame
+    """
+    framesoln = plotdata.getframe(frameno, plotdata.outdir)
+    patches = frames.solution_patches(framesoln)
+    solutions = []
+    for outdir in plotdata._outdirs:
+        region = plotdata._region_extents.get(os.path.abspath(outdir))
+        if os.path.abspath(outdir) == plotdata.outdir:
+            solutions.append(framesoln)
+        elif region is not None:
+            solutions.append(frames.to_solution(framesoln.t, [frames.crop_patch(patch, region) for patch in patches
+                                                              if frames._overlaps(patch, region)]))
+        else:
+            solutions.append(plotdata.getframe(frameno, outdir))
+    return solutions
+
+
+def clear_figure(figure):
+    """Clears the axes of a figure drawn before for the next frame, removing their colorbars"""
+    import matplotlib.pyplot as plt
+
+    if not plt.fignum_exists(figure.figno):
+        return
+    for axes in plt.figure(figure.figno).axes:
+        colorbar = getattr(axes, "_colorbar", None)
+        if colorbar is not None:
+            # Gives the space of the colorbar back to its axes
+            colorbar.remove()
+    for axes in plt.figure(figure.figno).axes:
+        axes.clear()
+
+
+def render_frame(frameno):
+    """Draws the figures of a frame in this process and prints them to plotdata.plotdir
+
+    :param int frameno: frame number
+    :return: the frame number and the number of PNGs written
+    """
+    from clawpack.visclaw import frametools
+
+    plotdata = _plotdata
+    figures = frame_figures(plotdata)
+    for figure in figures:
+        clear_figure(figure)
+    frametools.plot_frame(read_solutions(plotdata, frameno), plotdata, frameno)
+    for figure in figures:
+        frametools.printfig(frameno=frameno, figno=figure.figno, file_prefix=plotdata.file_prefix,
+                            format=plotdata.print_format, plotdir=plotdata.plotdir, verbose=False, close_fig=False)
+    return frameno, len(figures)
+
+
+def _start(outdir, plotdir, setplot):
+    # Forked processes inherit the figures set up by render, others set them up again
+    global _plotdata
+    if _plotdata is None:
+        _plotdata = setup(outdir, plotdir, setplot)
+
+
+def render(outdir="_output", plotdir="_plots", setplot="setplot.py", framenos=None, num_procs=None, gauges=True,
+           html=True):
+    """Draws the frame figures of setplot over a pool of processes
+
+    :param str outdir: output directory of the run
+    :param str plotdir: directory the PNGs are written to
+    :param str setplot: path to setplot.py
+    :param list framenos: frames to draw, defaults to all frames in outdir
+    :param int num_procs: number of processes, defaults to the number of cores available
+    :param bool gauges: also draw the gauge figures, in this process
+    :param bool html: make the HTML and LaTeX index pages as setplot asks, without movies
+    :return: the number of frames drawn and the frames drawn per second
+    """
+    global _plotdata
+    _plotdata = setup(outdir, plotdir, setplot)
+    if not os.path.exists(_plotdata.plotdir):
+        os.makedirs(_plotdata.plotdir)
+    if framenos is None:
+        framenos = sorted(int(name[-4:]) for name in os.listdir(_plotdata.outdir)
+                          if name.startswith("fort.t") and name[6:].isdigit())
+    if num_procs is None:
+        num_procs = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    num_procs = max(1, min(num_procs, len(framenos)))
+
+    start = time.perf_counter()
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    with context.Pool(num_procs, initializer=_start, initargs=(outdir, plotdir, setplot)) as pool:
+        for (frameno, num_figures) in pool.imap_unordered(render_frame, framenos):
+            print("Frame %s: %s figures" % (frameno, num_figures))
+    elapsed = time.perf_counter() - start
+    rate = len(framenos) / elapsed if elapsed > 0 else 0.0
+    print("%s frames in %.1f s with %s processes: %.2f frames/s" % (len(framenos), elapsed, num_procs, rate))
+
+    if gauges or html:
+        import incremental
+
+        if gauges:
+            # Gauge figures are printed and closed by visclaw
+            _plotdata.printfigs = True
+            gaugenos = sorted(int(name[5:10]) for name in os.listdir(_plotdata.outdir)
+                              if name.startswith("gauge") and name.endswith(".txt") and name[5:10].isdigit())
+            fignos = [figure.figno for figure in _plotdata.plotfigure_dict.values() if figure.type == "each_gauge"]
+            incremental.draw(_plotdata, {}, {gaugeno: fignos for gaugeno in gaugenos})
+        if html and (_plotdata.html or _plotdata.latex):
+            incremental.index(_plotdata)
+    return len(framenos), rate
+
+
+if __name__ == '__main__':
+    outdir = sys.argv[1] if len(sys.argv) > 1 else "_output"
+    plotdir = sys.argv[2] if len(sys.argv) > 2 else "_plots"
+    render(outdir, plotdir)
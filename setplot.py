@@ -2,19 +2,14 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import os
+import sys
+import json
+import time
 
 import numpy as np
-import matplotlib.pyplot as plt
-import datetime
-from collections import deque
 
-import clawpack.visclaw.gaugetools as gaugetools
-import clawpack.visclaw.frametools as frametools
-import clawpack.clawutil.data as clawutil
-import clawpack.geoclaw.data as geodata
-import clawpack.geoclaw.util as geoutil
-
-import clawpack.geoclaw.surge.plot as surgeplot
+import frames
+import observations
 
 try:
     from setplotfg import setplotfg
@@ -30,6 +25,57 @@ def days2seconds(days):
 # Scratch directory for caching observed water levels at gauges
 scratch_dir = os.path.join(os.getcwd(), 'scratch')
 
+# Draw the regional figures from subsets of the frames (see frames.extract_regions)
+extract_regions = True
+
+# Files of the run read by setplot, parsed once into outdir/plot_metadata.json
+metadata_files = ["claw.data", "surge.data", "friction.data"]
+
+
+def run_metadata(outdir):
+    """Reads the parts of the run data setplot uses, parsing the data files only when they changed
+
+    The first call of setplot in a plotting run parses them and writes outdir/plot_metadata.json, which the plotting
+    workers read instead, without importing the data modules of clawutil and geoclaw.
+
+    :param str outdir: output directory of the run
+    :return: a dictionary with the domain "lower" and "upper" corners, "output_format", "output_aux_onlyonce",
+            "variable_friction", "pressure_forcing" and "wind_forcing"
+    """
+    path = os.path.join(outdir, "plot_metadata.json")
+    stamps = {name: os.path.getmtime(os.path.join(outdir, name)) for name in metadata_files
+              if os.path.exists(os.path.join(outdir, name))}
+    try:
+        with open(path, "r") as metadata_file:
+            metadata = json.load(metadata_file)
+        if metadata["stamps"] == stamps:
+            return metadata
+    except (OSError, ValueError, KeyError):
+        pass
+
+    import clawpack.clawutil.data as clawutil
+    import clawpack.geoclaw.data as geodata
+
+    clawdata = clawutil.ClawInputData(2)
+    clawdata.read(os.path.join(outdir, 'claw.data'))
+    surge_data = geodata.SurgeData()
+    surge_data.read(os.path.join(outdir, 'surge.data'))
+    friction_data = geodata.FrictionData()
+    friction_data.read(os.path.join(outdir, 'friction.data'))
+
+    metadata = {"stamps": stamps,
+                "lower": list(clawdata.lower), "upper": list(clawdata.upper),
+                "output_format": int(clawdata.output_format),
+                "output_aux_onlyonce": bool(clawdata.output_aux_onlyonce),
+                "variable_friction": bool(friction_data.variable_friction),
+                "pressure_forcing": bool(surge_data.pressure_forcing),
+                "wind_forcing": bool(surge_data.wind_forcing)}
+    tmp_path = "%s.%s" % (path, os.getpid())
+    with open(tmp_path, "w") as metadata_file:
+        json.dump(metadata, metadata_file)
+    os.replace(tmp_path, path)
+    return metadata
+
 
 def setplot(plotdata=None):
     if plotdata is None:
@@ -38,19 +84,19 @@ def setplot(plotdata=None):
 
     # clear any old figures,axes,items data
     plotdata.clearfigures()
-    plotdata.format = 'ascii'
+
+    # The plot helpers of surge.plot are needed to set up the figures, pyplot and gaugetools only to draw them
+    import clawpack.geoclaw.surge.plot as surgeplot
 
     # Load data from output
-    clawdata = clawutil.ClawInputData(2)
-    clawdata.read(os.path.join(plotdata.outdir, 'claw.data'))
-    physics = geodata.GeoClawData()
-    physics.read(os.path.join(plotdata.outdir, 'geoclaw.data'))
-    surge_data = geodata.SurgeData()
-    surge_data.read(os.path.join(plotdata.outdir, 'surge.data'))
-    friction_data = geodata.FrictionData()
-    friction_data.read(os.path.join(plotdata.outdir, 'friction.data'))
+    metadata = run_metadata(plotdata.outdir)
+
+    # Read frames in the output format of setrun
+    plotdata.format = {1: 'ascii', 2: 'binary32', 3: 'binary'}[metadata["output_format"]]
+    if metadata["output_aux_onlyonce"]:
+        frames.read_aux_once(plotdata)
 
-    # Load storm track
+    # Load storm track, read again by track_data while fort.track is still growing
     track = surgeplot.track_data(os.path.join(plotdata.outdir, 'fort.track'))
 
     # Color limits
@@ -77,13 +123,56 @@ def setplot(plotdata=None):
     # ==========================================================================
     #   Plot specifications
     # ==========================================================================
-    regions = {"Full Domain": {"xlimits": (clawdata.lower[0],
-                                           clawdata.upper[0]),
-                               "ylimits": (clawdata.lower[1],
-                                           clawdata.upper[1])},
+    regions = {"Full Domain": {"xlimits": (metadata["lower"][0],
+                                           metadata["upper"][0]),
+                               "ylimits": (metadata["lower"][1],
+                                           metadata["upper"][1])},
                "Carolinas": {"xlimits": (-80.5, -77.0),
                              "ylimits": (31.5, 35)}}
 
+    gauge_regions = {"Mayport": {"xlimits": (-81.435, -81.39),
+                                 "ylimits": (30.39, 30.41),
+                                 "gaugenos": [1]},
+                     "Fort Pulaski": {"xlimits": (-80.94, -80.84),
+                                      "ylimits": (32.005, 32.058),
+                                      "gaugenos": [2]},
+                     "Charleston, Cooper River Entrance": {"xlimits": (-79.951, -79.836),
+                                                           "ylimits": (32.731, 32.805),
+                                                           "gaugenos": [3]},
+                     "Wrightsville Beach": {"xlimits": (-77.7953, -77.7834),
+                                            "ylimits": (34.2106, 34.2176),
+                                            "gaugenos": [4]},
+                     "Wilmington": {"xlimits": (-78.03, -77.87),
+                                    "ylimits": (33.82, 34.25),
+                                    "gaugenos": [5]},
+                     "Carolinas": {"xlimits": (-80.5, -77.0),
+                                   "ylimits": (31.5, 35),
+                                   "gaugenos": [3, 4, 5, 6]},
+                     "All": {"xlimits": (-82.0, -77.0),
+                             "ylimits": (30.0, 35.0),
+                             "gaugenos": "all"}}
+
+    # Extract the parts of the frames shown by each regional figure once, so that these figures only read those. A
+    # caller that cuts the subsets out of the frames itself (see render.read_solutions) sets plotdata._region_extents,
+    # which gets the extent of the subsets in each output directory instead
+    subsets = {}
+    if extract_regions:
+        zooms = dict(regions, **gauge_regions)
+        zooms.pop("Full Domain")
+        extents = {name: list(region_dict["xlimits"]) + list(region_dict["ylimits"])
+                   for (name, region_dict) in zooms.items()}
+        subsets = {name: frames.region_outdir(plotdata.outdir, name) for name in zooms}
+        if hasattr(plotdata, "_region_extents"):
+            plotdata._region_extents.update({os.path.abspath(subsets[name]): extent
+                                             for (name, extent) in extents.items()})
+        else:
+            frames.extract_regions(plotdata.outdir, extents)
+
+    def read_subset(plotaxes, name):
+        # Points the plot items of a regional figure to the frames of its region
+        for plotitem in plotaxes.plotitem_dict.values():
+            plotitem.outdir = subsets.get(name, plotitem.outdir)
+
     for (name, region_dict) in regions.items():
         # Surface Figure
         plotfigure = plotdata.new_plotfigure(name="Surface - %s" % name)
@@ -94,6 +183,7 @@ def setplot(plotdata=None):
         surgeplot.add_land(plotaxes)
         plotaxes.plotitem_dict['surface'].amr_patchedges_show = [0] * 10
         plotaxes.plotitem_dict['land'].amr_patchedges_show = [0] * 10
+        read_subset(plotaxes, name)
 
         # Speed Figure
         plotfigure = plotdata.new_plotfigure(name="Currents - %s" % name)
@@ -104,14 +194,16 @@ def setplot(plotdata=None):
         surgeplot.add_land(plotaxes, bounds=color_limits)
         plotaxes.plotitem_dict['speed'].amr_patchedges_show = [0] * 10
         plotaxes.plotitem_dict['land'].amr_patchedges_show = [0] * 10
+        read_subset(plotaxes, name)
     #
     # Friction field
     #
     plotfigure = plotdata.new_plotfigure(name='Friction')
-    plotfigure.show = friction_data.variable_friction and True
+    plotfigure.show = metadata["variable_friction"] and not metadata["output_aux_onlyonce"]
     plotaxes = plotfigure.new_plotaxes()
-    standard_setup(None, regions['Full Domain']['xlimits'], regions['Full Domain']['ylimits'],
-                   """plt.title(r"Manning\'s $n$ Coefficient")""")
+    standard_setup(r"Manning's $n$ Coefficient", regions['Full Domain']['xlimits'], regions['Full Domain']['ylimits'],
+                   None)
+    plotaxes.title_with_t = False
 
     surgeplot.add_friction(plotaxes, bounds=friction_bounds)
     plotaxes.plotitem_dict['friction'].amr_patchedges_show = [0] * 10
@@ -122,7 +214,7 @@ def setplot(plotdata=None):
     #
     # Pressure field
     plotfigure = plotdata.new_plotfigure(name='Pressure')
-    plotfigure.show = surge_data.pressure_forcing and True
+    plotfigure.show = metadata["pressure_forcing"] and not metadata["output_aux_onlyonce"]
     plotaxes = plotfigure.new_plotaxes()
     standard_setup("Pressure Field", regions['Full Domain']['xlimits'], regions['Full Domain']['ylimits'],
                    surge_afteraxes)
@@ -132,7 +224,7 @@ def setplot(plotdata=None):
 
     # Wind field
     plotfigure = plotdata.new_plotfigure(name='Wind Speed')
-    plotfigure.show = surge_data.wind_forcing and True
+    plotfigure.show = metadata["wind_forcing"] and not metadata["output_aux_onlyonce"]
     plotaxes = plotfigure.new_plotaxes()
     standard_setup("Wind Field", regions['Full Domain']['xlimits'], regions['Full Domain']['ylimits'], surge_afteraxes)
 
@@ -147,31 +239,29 @@ def setplot(plotdata=None):
     plotfigure.show = True
     plotfigure.clf_each_gauge = True
 
-    stations = [('8720218', 'Mayport (Bar Pilots Dock), FL'),
-                ('8670870', 'Fort Pulaski, GA'),
-                ('8665530', 'Charleston, Cooper River Entrance, SC'),
-                ('8658163', 'Wrightsville Beach, NC'),
-                ('8658120', 'Wilmington, NC')]
+    stations = observations.stations
+    landfall_time = observations.landfall_time
 
-    landfall_time = np.datetime64('2016-10-08T12:00')
-    begin_date = datetime.datetime(2016, 10, 6, 12)
-    end_date = datetime.datetime(2016, 10, 9, 12)
+    # Observed surge of all stations, loaded once per plotting process when the first gauge is drawn
+    observed = {}
 
     def gauge_afteraxes(current_data):
+        import matplotlib.pyplot as plt
+
+        if not observed:
+            observed.update(observations.load_observations(cache_dir=scratch_dir))
         axes = plt.gca()
 
         surgeplot.plot_landfall_gauge(current_data.gaugesoln, axes)
         station_id, station_name = stations[current_data.gaugeno - 1]
 
-        date_time, water_level, prediction = geoutil.fetch_noaa_tide_data(station_id, begin_date, end_date,
-                                                                          cache_dir=scratch_dir)
+        # Stations that could not be fetched from NOAA are left out of load_observations
+        if station_id in observed:
+            date_time, water_level = observed[station_id]
+            # Calculate times relative to landfall
+            seconds_rel_landfall = (date_time - landfall_time) / np.timedelta64(1, 's')
 
-        # Subtract tide predictions from measured water levels
-        water_level -= prediction
-        # Calculate times relative to landfall
-        seconds_rel_landfall = (date_time - landfall_time) / np.timedelta64(1, 's')
-
-        axes.plot(seconds_rel_landfall, water_level, 'g', label='Observed')
+            axes.plot(seconds_rel_landfall, water_level, 'g', label='Observed')
 
         # Fix up plot
         axes.set_title(station_name + " - Station ID: " + station_id)
@@ -195,54 +285,29 @@ def setplot(plotdata=None):
     #
     #  Gauge Location Plot
     #
-    gauge_regions = {"Mayport": {"xlimits": (-81.435, -81.39),
-                                 "ylimits": (30.39, 30.41),
-                                 "gaugenos": [1]},
-                     "Fort Pulaski": {"xlimits": (-80.94, -80.84),
-                                      "ylimits": (32.005, 32.058),
-                                      "gaugenos": [2]},
-                     "Charleston, Cooper River Entrance": {"xlimits": (-79.951, -79.836),
-                                                           "ylimits": (32.731, 32.805),
-                                                           "gaugenos": [3]},
-                     "Wrightsville Beach": {"xlimits": (-77.7953, -77.7834),
-                                            "ylimits": (34.2106, 34.2176),
-                                            "gaugenos": [4]},
-                     "Wilmington": {"xlimits": (-78.03, -77.87),
-                                    "ylimits": (33.82, 34.25),
-                                    "gaugenos": [5]},
-                     "Carolinas": {"xlimits": (-80.5, -77.0),
-                                   "ylimits": (31.5, 35),
-                                   "gaugenos": [3, 4, 5, 6]},
-                     "All": {"xlimits": (-82.0, -77.0),
-                             "ylimits": (30.0, 35.0),
-                             "gaugenos": "all"}}
-
-    # Need queue since gauge_location_afteraxes will use the gaugenos specified for all plots that call it (because
-    # it is executed after creating all plot items)
-    num_frames = len(frametools.only_most_recent(plotdata.print_framenos, plotdata.outdir))
-    queue = deque(list(gauge_regions.keys()) * num_frames)
-
-    def which_gauges():
-        # Returns gaugenos from current region_dict - used by gauge_location_afteraxes
-        gaugenos = (gauge_regions[queue[0]])["gaugenos"]
-        queue.popleft()
-        return gaugenos
-
-    def gauge_location_afteraxes(current_data):
-        plt.subplots_adjust(left=0.12, bottom=0.06, right=0.97, top=0.97)
-        surge_afteraxes(current_data)
-        gaugetools.plot_gauge_locations(current_data.plotdata, gaugenos=which_gauges(),
-                                        format_string='ko', add_labels=True)
+    def gauge_location_afteraxes(gaugenos):
+        # Each figure gets its own afteraxes holding its gauges, so figures can be drawn in any order
+        def afteraxes(current_data):
+            import matplotlib.pyplot as plt
+            import clawpack.visclaw.gaugetools as gaugetools
+
+            plt.subplots_adjust(left=0.12, bottom=0.06, right=0.97, top=0.97)
+            surge_afteraxes(current_data)
+            gaugetools.plot_gauge_locations(current_data.plotdata, gaugenos=gaugenos,
+                                            format_string='ko', add_labels=True)
+        return afteraxes
 
     for (name, region_dict) in gauge_regions.items():
         plotfigure = plotdata.new_plotfigure(name="Gauge Locations - %s" % name)
         plotaxes = plotfigure.new_plotaxes()
-        standard_setup("Gauge Locations", region_dict["xlimits"], region_dict["ylimits"], gauge_location_afteraxes)
+        standard_setup("Gauge Locations", region_dict["xlimits"], region_dict["ylimits"],
+                       gauge_location_afteraxes(region_dict["gaugenos"]))
 
         surgeplot.add_surface_elevation(plotaxes, bounds=surface_limits)
         surgeplot.add_land(plotaxes)
         plotaxes.plotitem_dict['surface'].amr_patchedges_show = [0] * 10
         plotaxes.plotitem_dict['land'].amr_patchedges_show = [0] * 10
+        read_subset(plotaxes, name)
 
     # -----------------------------------------
     # Parameters used only when creating html and/or latex hardcopy
@@ -261,3 +326,58 @@ def setplot(plotdata=None):
     plotdata.parallel = True  # parallel plotting
 
     return plotdata
+
+
+def startup_times(outdir="_output", frameno=None):
+    """Measures the startup cost of setplot in a plotting worker
+
+    A new Python process imports the visclaw plotting modules, as a worker of plotclaw has, and then times the import
+    of setplot, a call of setplot, reading the run metadata written by an earlier call, and the first drawing of the
+    figures of a frame, which loads the modules that only drawing needs.
+
+    :param str outdir: output directory of the run
+    :param int frameno: frame drawn, defaults to the first frame in outdir
+    :return: a dictionary with the seconds of the "import", of "setplot" and of the "first_draw", and the number of
+            "modules" loaded by all three
+    """
+    import subprocess
+
+    if frameno is None:
+        frameno = min(int(name[6:]) for name in os.listdir(outdir) if name.startswith("fort.t") and name[6:].isdigit())
+    code = "\n".join(["import sys, json, time",
+                      "import matplotlib",
+                      "matplotlib.use('Agg')",
+                      "from clawpack.visclaw import frametools",
+                      "from clawpack.visclaw.data import ClawPlotData",
+                      "modules = len(sys.modules)",
+                      "start = time.perf_counter()",
+                      "import setplot",
+                      "imported = time.perf_counter()",
+                      "plotdata = ClawPlotData()",
+                      "plotdata.outdir = %r" % os.path.abspath(outdir),
+                      "setplot.setplot(plotdata)",
+                      "set_up = time.perf_counter()",
+                      "plotdata._mode = 'printframes'",
+                      "plotdata.printfigs = False",
+                      "frametools.set_show(plotdata)",
+                      "plotdata.set_outdirs()",
+                      "frametools.plot_frame([plotdata.getframe(%d, outdir) for outdir in plotdata._outdirs], plotdata,"
+                      " %d)" % (frameno, frameno),
+                      "print(json.dumps({'import': imported - start, 'setplot': set_up - imported,",
+                      "                  'first_draw': time.perf_counter() - set_up,",
+                      "                  'modules': len(sys.modules) - modules}))"])
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(output.decode().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    from clawpack.visclaw.data import ClawPlotData
+
+    plotdata = ClawPlotData()
+    plotdata.outdir = sys.argv[1] if len(sys.argv) > 1 else "_output"
+    start = time.perf_counter()
+    setplot(plotdata)
+    print("First setplot: %.3f s" % (time.perf_counter() - start))
+    times = startup_times(plotdata.outdir)
+    print("Plotting worker: import %.3f s, setplot %.3f s, first frame drawn in %.3f s, %s modules loaded" % (
+        times["import"], times["setplot"], times["first_draw"], times["modules"]))
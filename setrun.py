@@ -12,16 +12,15 @@ from __future__ import print_function
 
 import os
 import datetime
-import gzip
 
 import numpy as np
 
-from clawpack.geoclaw.surge.storm import Storm
-from clawpack.geoclaw import topotools
-import clawpack.clawutil as clawutil
-
-from clawpack.amrclaw import region_tools
 from clawpack.amrclaw.data import FlagRegion
+from clawpack.geoclaw.fgmax_tools import FGmaxGrid
+
+import checkpoints
+import inputcache
+import prefetch
 
 
 # Time Conversions
@@ -37,14 +36,70 @@ scratch_dir = os.path.join(os.getcwd(), 'scratch')
 if not os.path.exists(scratch_dir):
     os.makedirs(scratch_dir)
 
+# Crops of the CRM netCDF topography used as topofiles, as [x1, x2, y1, y2] extents and the .asc file each is written
+# to (defaults to a name made from the extent when "path" is left out)
+crm_tiles = [{"extent": [-81.5, -77.0, 31.5, 34.8],
+              "path": os.path.join(scratch_dir, 'crm_vol2_se_atl.asc')}]
+
+# Format of the topofiles handed to GeoClaw, 'ascii' (topotype 3) or 'netcdf' to convert them once to compressed
+# topotype 4 files, which requires GeoClaw compiled with NetCDF support (see Makefile)
+topo_format = 'ascii'
+
+# Format of the output frames, 'ascii' or 'binary'. Binary frames are much smaller and faster to read (see frames.py),
+# and the aux arrays are then only written at t0, so setplot leaves out the friction, pressure and wind figures
+output_format = 'ascii'
+
+# Run profiles, selected with setrun(profile=...) or the MATTHEW_PROFILE environment variable (default "production").
+# "smoke" keeps the storm, topography and gauges but covers only 18 hours around landfall on a coarser grid with fewer
+# levels, so that a whole run finishes in minutes for regression checks (see smoke.py), and always starts from t0
+run_profiles = {"production": {"degree_factor": 4, "amr_levels_max": 6, "t0": days2seconds(-2),
+                               "tfinal": days2seconds(1), "recurrence": 4, "auto_restart": True},
+                "smoke": {"degree_factor": 2, "amr_levels_max": 4, "t0": days2seconds(-0.5),
+                          "tfinal": days2seconds(0.25), "recurrence": 4, "auto_restart": False}}
+
+# Checkpoints are written every checkpt_interval seconds of simulated time, and checkpoints.py keeps only the newest
+# keep_checkpoints of them. With auto_restart, make data sets up a run to restart from the newest complete checkpoint in
+# checkpoint_dir, the OUTDIR of the Makefile, if the run has not finished and was made with the same run profile (remove
+# the checkpoints or set MATTHEW_RESTART=0 to start over)
+checkpt_interval = days2seconds(0.25)
+keep_checkpoints = 2
+auto_restart = os.environ.get("MATTHEW_RESTART", "1") != "0"
+checkpoint_dir = os.path.abspath(os.environ.get("OUTDIR", "_output").strip())
+
+# Flagregions covered by fixed (fgmax) grids at the resolution of the finest level, on which GeoClaw records the maximum
+# surface, maximum speed and arrival time during the run (see fgmax.py). Values are checked every fgmax_dt_check
+# seconds, and the surge has arrived once the surface is fgmax_arrival_tol meters above sea level
+fgmax_regions = ["mayport", "pulaski", "charleston", "wilmington"]
+fgmax_dt_check = 60.0
+fgmax_arrival_tol = 0.1
+
+
+def select_profile(profile=None):
+    """Name of the run profile, one of run_profiles, defaults to $MATTHEW_PROFILE or "production"."""
+    if profile is None:
+        profile = os.environ.get("MATTHEW_PROFILE", "production")
+    if profile not in run_profiles:
+        raise ValueError("Unknown run profile %s, expected one of %s" % (profile, ", ".join(run_profiles)))
+    return profile
+
+
+def recorded_profile(profile=None):
+    """Run profile as recorded next to the checkpoints of a run, see checkpoints.write_profile"""
+    profile = select_profile(profile)
+    return dict(run_profiles[profile], name=profile)
+
 
 # ------------------------------
-def setrun(claw_pkg='geoclaw'):
+def setrun(claw_pkg='geoclaw', profile=None, restart_dir=None):
     """
     Define the parameters used for running Clawpack.
 
     INPUT:
         claw_pkg expected to be "geoclaw" for this setrun.
+        profile is one of run_profiles, defaults to $MATTHEW_PROFILE or "production".
+        restart_dir is the output directory of the run. If given, the profile allows it and auto_restart is set, the
+        run restarts from its newest complete checkpoint (see checkpoints.latest_checkpoint). Defaults to None, always
+        starting from t0.
 
     OUTPUT:
         rundata - object of class ClawRunData
@@ -55,6 +110,9 @@ def setrun(claw_pkg='geoclaw'):
 
     assert claw_pkg.lower() == 'geoclaw', "Expected claw_pkg = 'geoclaw'"
 
+    profile = select_profile(profile)
+    run_profile = run_profiles[profile]
+
     num_dim = 2
     rundata = data.ClawRunData(claw_pkg, num_dim)
 
@@ -82,7 +140,7 @@ def setrun(claw_pkg='geoclaw'):
     clawdata.upper[1] = 45  # north latitude
 
     # Number of grid cells:
-    degree_factor = 4  # (0.25º,0.25º) ~ (25237.5 m, 27693.2 m) resolution
+    degree_factor = run_profile["degree_factor"]  # 4 => (0.25º,0.25º) ~ (25237.5 m, 27693.2 m) resolution
     clawdata.num_cells[0] = int(clawdata.upper[0] - clawdata.lower[0]) * degree_factor
     clawdata.num_cells[1] = int(clawdata.upper[1] - clawdata.lower[1]) * degree_factor
 
@@ -104,7 +162,7 @@ def setrun(claw_pkg='geoclaw'):
     # -------------
     # Initial time:
     # -------------
-    clawdata.t0 = -days2seconds(2)
+    clawdata.t0 = run_profile["t0"]
 
     # Restart from checkpoint file of a previous run?
     # If restarting, t0 above should be from original run, and the
@@ -114,6 +172,16 @@ def setrun(claw_pkg='geoclaw'):
     clawdata.restart = False  # True to restart from prior results
     clawdata.restart_file = 'fort.chk00006'  # File to use for restart data
 
+    # Continue an interrupted run from its newest complete checkpoint
+    latest_checkpoint = None
+    if restart_dir is not None and auto_restart and run_profile["auto_restart"]:
+        latest_checkpoint = checkpoints.latest_checkpoint(restart_dir, tfinal=run_profile["tfinal"],
+                                                          profile=recorded_profile(profile))
+    if latest_checkpoint is not None:
+        print("Restarting from %s" % os.path.join(restart_dir, latest_checkpoint))
+        clawdata.restart = True
+        clawdata.restart_file = latest_checkpoint
+
     # -------------
     # Output times:
     # --------------
@@ -126,8 +194,8 @@ def setrun(claw_pkg='geoclaw'):
 
     if clawdata.output_style == 1:
         # Output nout frames at equally spaced times up to tfinal:
-        clawdata.tfinal = days2seconds(1)
-        recurrence = 4
+        clawdata.tfinal = run_profile["tfinal"]
+        recurrence = run_profile["recurrence"]  # outputs per day
         clawdata.num_output_times = int((clawdata.tfinal - clawdata.t0) *
                                         recurrence / (60 ** 2 * 24))
 
@@ -143,10 +211,10 @@ def setrun(claw_pkg='geoclaw'):
         clawdata.total_steps = 1
         clawdata.output_t0 = True
 
-    clawdata.output_format = 'ascii'  # 'ascii' or 'binary'
+    clawdata.output_format = output_format  # 'ascii' or 'binary'
     clawdata.output_q_components = 'all'  # could be list such as [True,True]
     clawdata.output_aux_components = 'all'
-    clawdata.output_aux_onlyonce = False  # output aux arrays only at t0
+    clawdata.output_aux_onlyonce = output_format != 'ascii'  # output aux arrays only at t0
 
     # ---------------------------------------------------
     # Verbosity of messages to screen during integration:
@@ -242,7 +310,7 @@ def setrun(claw_pkg='geoclaw'):
     # Specify when checkpoint files should be created that can be
     # used to restart a computation.
 
-    clawdata.checkpt_style = 0
+    clawdata.checkpt_style = 2
 
     if clawdata.checkpt_style == 0:
         # Do not checkpoint at all
@@ -254,7 +322,9 @@ def setrun(claw_pkg='geoclaw'):
 
     elif np.abs(clawdata.checkpt_style) == 2:
         # Specify a list of checkpoint times.
-        clawdata.checkpt_times = [0.1, 0.15]
+        # Every checkpt_interval, or only at tfinal for runs shorter than that
+        clawdata.checkpt_times = list(np.arange(clawdata.t0 + checkpt_interval, clawdata.tfinal,
+                                                checkpt_interval)) or [clawdata.tfinal]
 
     elif np.abs(clawdata.checkpt_style) == 3:
         # Checkpoint every checkpt_interval timesteps (on Level 1)
@@ -270,7 +340,7 @@ def setrun(claw_pkg='geoclaw'):
     # amrdata.memsize = 16777212
 
     # max number of refinement levels:
-    amrdata.amr_levels_max = 6
+    amrdata.amr_levels_max = run_profile["amr_levels_max"]
 
     # List of refinement ratios at each level (length at least amr_max_levels-1)
     # ratios start at level 2 (ratio 4 is to get from level 5 to level 6)
@@ -329,37 +399,32 @@ def setrun(claw_pkg='geoclaw'):
     # append as many flagregions as desired to this list:
     flagregions = rundata.flagregiondata.flagregions
 
-    from kml2slu import kml2slu
-    # Coverts .kml file with polygons drawn in Google Earth to slu format
-    slus = kml2slu("regions.kml")
+    flag_regions = {"mayport": {"levels": (6, 6)},
+                    "pulaski": {"levels": (4, 6)},
+                    "charleston": {"levels": (4, 6)},
+                    "wilmington": {"levels": (6, 6)}}
 
-    flag_regions = {"mayport": {"levels": (6, 6),
-                                "slu": slus.get("mayport")},
-                    "pulaski": {"levels": (4, 6),
-                                "slu": slus.get("pulaski")},
-                    "charleston": {"levels": (4, 6),
-                                   "slu": slus.get("charleston")},
-                    "wilmington": {"levels": (6, 6),
-                                   "slu": slus.get("wilmington")}}
+    # Coverts .kml file with polygons drawn in Google Earth to RuledRectangle .data files, unless the .kml file is
+    # unchanged since they were last written
+    rr_files = inputcache.ruled_rectangles("regions.kml", flag_regions.keys(), ixy='y', method=1,
+                                           cache_dir=scratch_dir)
 
     for (name, region_dict) in flag_regions.items():
-        # write RuledRectangle .data file
-        rr = region_tools.RuledRectangle(slu=region_dict["slu"])
-        rr.ixy = 'y'
-        rr.method = 1
-        rr.write('RuledRectangle_%s.data' % name)
-
         # use RuledRectangle .data file and desired refinement levels to append to flagregions
         flagregion = FlagRegion(num_dim=2)
         flagregion.name = 'Region_' + name
-        flagregion.minlevel = region_dict["levels"][0]
-        flagregion.maxlevel = region_dict["levels"][1]
+        # capped at amr_levels_max for profiles with fewer levels
+        flagregion.minlevel = min(region_dict["levels"][0], amrdata.amr_levels_max)
+        flagregion.maxlevel = min(region_dict["levels"][1], amrdata.amr_levels_max)
         flagregion.t1 = rundata.clawdata.t0
         flagregion.t2 = rundata.clawdata.tfinal
         flagregion.spatial_region_type = 2  # Ruled Rectangle
-        flagregion.spatial_region_file = os.path.abspath('RuledRectangle_%s.data' % name)
+        flagregion.spatial_region_file = rr_files[name]
         flagregions.append(flagregion)
 
+    # == fgmax_grids.data values ==
+    set_fgmax_grids(rundata)
+
     # == setgauges.data values ==
     # for gauges append lines of the form  [gaugeno, x, y, t1, t2]
     # Mayport (Bar Pilots Dock), FL - Station ID: 8720218
@@ -386,6 +451,50 @@ def setrun(claw_pkg='geoclaw'):
     # ----------------------
 
 
+def finest_dx(rundata):
+    """Cell width (degrees) of the finest AMR level of rundata"""
+    clawdata = rundata.clawdata
+    amrdata = rundata.amrdata
+    return ((clawdata.upper[0] - clawdata.lower[0]) / clawdata.num_cells[0]
+            / np.prod(amrdata.refinement_ratios_x[:amrdata.amr_levels_max - 1]))
+
+
+def set_fgmax_grids(rundata, points_dir=scratch_dir):
+    """
+    Set the fgmax grids of fgmax_regions from the flagregions of rundata.
+
+    The points of each grid are those of the finest level inside the RuledRectangle of its flagregion, and values are
+    recorded from the level the flagregion always refines to. Called again when the levels, refinement ratios or times
+    of rundata change (see ensemble.apply_member).
+
+    INPUT:
+        rundata with the flagregions of setrun.
+        points_dir is the directory the points files are written to.
+    """
+    clawdata = rundata.clawdata
+    fgmax_data = rundata.fgmax_data
+    fgmax_data.num_fgmax_val = 2  # maximum depth and speed
+    fgmax_data.fgmax_grids = []
+    dx = finest_dx(rundata)
+    flagregions = {flagregion.name.replace('Region_', '', 1): flagregion
+                   for flagregion in rundata.flagregiondata.flagregions}
+    for name in fgmax_regions:
+        # points of the finest grid inside the RuledRectangle of the flagregion
+        fg = FGmaxGrid()
+        fg.id = name
+        fg.point_style = 4
+        fg.xy_fname = inputcache.fgmax_points(flagregions[name].spatial_region_file, dx,
+                                              os.path.join(points_dir, 'fgmax_%s.asc' % name), cache_dir=scratch_dir)
+        fg.tstart_max = clawdata.t0
+        fg.tend_max = clawdata.tfinal
+        fg.dt_check = fgmax_dt_check
+        # the level the flagregion always refines to
+        fg.min_level_check = flagregions[name].minlevel
+        fg.arrival_tol = fgmax_arrival_tol
+        fg.interp_method = 0  # piecewise constant
+        fgmax_data.fgmax_grids.append(fg)
+
+
 # -------------------
 def setgeo(rundata):
     """
@@ -430,24 +539,28 @@ def setgeo(rundata):
     #   [topotype, fname]
     # See regions for control over these regions, need better bathy data for
     # the smaller domains
-    clawutil.data.get_remote_file(
-        "https://www.dropbox.com/s/s58bi1l45tw9uka/gebco_2020_n50.0_s10.0_w-90.0_e-60.0.asc?dl=1", scratch_dir,
-        file_name="gebco_2020_n50.0_s10.0_w-90.0_e-60.0.asc", verbose=True)
-    full_topo_path = os.path.join(scratch_dir, 'gebco_2020_n50.0_s10.0_w-90.0_e-60.0.asc')
-    topo_data.topofiles.append([3, full_topo_path])
-
-    clawutil.data.get_remote_file("https://www.ngdc.noaa.gov/thredds/fileServer/crm/crm_vol2.nc", scratch_dir,
-                                  file_name="crm_vol2_se_atl.nc", verbose=True)
-    southeast_topo_path = os.path.join(scratch_dir, 'crm_vol2_se_atl')
-    topotools.read_netcdf((southeast_topo_path + ".nc"), extent=[-81.5, -77.0, 31.5, 34.8], verbose=True).write(
-        (southeast_topo_path + ".asc"), topo_type=3, no_data_value=-32767, header_style="asc", Z_format='%.0f')
-    topo_data.topofiles.append([3, (southeast_topo_path + ".asc")])
-
-    # == setfixedgrids.data values ==
-    rundata.fixed_grid_data.fixedgrids = []
-    # for fixed grids append lines of the form
-    # [t1,t2,noutput,x1,x2,y1,y2,xpoints,ypoints,\
-    #  ioutarrivaltimes,ioutsurfacemax]
+    # Remote inputs are only downloaded when missing from scratch, all at the same time (see prefetch.py)
+    remote_files = prefetch.prefetch(output_dir=scratch_dir, verify_hash=False)
+    full_topo_path = remote_files['gebco_2020_n50.0_s10.0_w-90.0_e-60.0.asc']
+    topo_files = [full_topo_path]
+
+    southeast_topo_path = remote_files['crm_vol2_se_atl.nc']
+    for tile in crm_tiles:
+        # Only converted again when the netCDF file, extent or format options change
+        tile_path = inputcache.crop_netcdf_topo(southeast_topo_path, tile["extent"], out_path=tile.get("path"),
+                                                topo_type=3, no_data_value=-32767, header_style="asc",
+                                                Z_format='%.0f', cache_dir=scratch_dir)
+        topo_files.append(tile_path)
+
+    for topo_path in topo_files:
+        if topo_format == 'netcdf':
+            # Both files only hold whole meters, so 16 bit integers lose nothing
+            # Written to <name>_topo4.nc, never over the downloaded inputs
+            topo_path = inputcache.convert_topo(topo_path, src_topo_type=3, dtype='i2', no_data_value=-32767,
+                                                protected_paths=remote_files.values(), cache_dir=scratch_dir)
+            topo_data.topofiles.append([4, topo_path])
+        else:
+            topo_data.topofiles.append([3, topo_path])
 
     # ================
     #  Set Surge Data
@@ -470,22 +583,11 @@ def setgeo(rundata):
     data.storm_file = os.path.expandvars(os.path.join(os.getcwd(),
                                                       'matthew.storm'))
 
-    # Convert ATCF data to GeoClaw format
-    clawutil.data.get_remote_file(
-        "https://ftp.nhc.noaa.gov/atcf/archive/2016/bal142016.dat.gz", scratch_dir)
-    atcf_path = os.path.join(scratch_dir, "bal142016.dat")
-    # Note that the get_remote_file function does not support gzip files which
-    # are not also tar files.  The following code handles this
-    with gzip.open(".".join((atcf_path, 'gz')), 'rb') as atcf_file, \
-            open(atcf_path, 'w') as atcf_unzipped_file:
-        atcf_unzipped_file.write(atcf_file.read().decode('ascii'))
-
-    matthew = Storm(path=atcf_path, file_format="ATCF")
-
-    # Calculate landfall time - Need to specify as the file above does not include (10/8/2016 ~ 12 UTC)
-    matthew.time_offset = datetime.datetime(2016, 10, 8, 12)
+    # Calculate landfall time - Need to specify as the ATCF file does not include (10/8/2016 ~ 12 UTC)
+    time_offset = datetime.datetime(2016, 10, 8, 12)
 
-    matthew.write(data.storm_file, file_format='geoclaw')
+    # Convert ATCF data to GeoClaw format, only done again when the .gz file or landfall time change
+    inputcache.atcf2storm(remote_files['bal142016.dat.gz'], data.storm_file, time_offset, cache_dir=scratch_dir)
 
     # =======================
     #  Set Variable Friction
@@ -517,8 +619,11 @@ if __name__ == '__main__':
     import sys
 
     if len(sys.argv) == 2:
-        rundata = setrun(sys.argv[1])
+        rundata = setrun(sys.argv[1], restart_dir=checkpoint_dir)
     else:
-        rundata = setrun()
+        rundata = setrun(restart_dir=checkpoint_dir)
 
     rundata.write()
+    # Copied into the output directory with the data files, so that only runs of the same profile restart from its
+    # checkpoints
+    checkpoints.write_profile(os.getcwd(), recorded_profile())
@@ -0,0 +1,130 @@
+"""
+Skill of the modelled surge against the NOAA observations at every gauge.
+
+The GeoClaw gauge series and the de-tided observations (see observations.py) are interpolated onto one common time
+grid, and the RMSE, bias, peak error, peak timing error and Willmott skill of all gauges are computed together on the
+resulting 2-D arrays.
+
+    python skill.py [outdir] [skill.csv|skill.json]
+
+writes the metrics to outdir/skill.csv by default.
+"""
+
+import os
+import sys
+import csv
+import json
+
+import numpy as np
+
+import gauges
+import observations
+
+
+# Metrics written for each gauge, in order
+metrics = ["rmse", "bias", "peak_error", "peak_time_error", "willmott"]
+
+
+def align(outdir="_output", dt=360.0, cache_dir=observations.scratch_dir):
+    """Interpolates the modelled and observed surge of all gauges with a NOAA station onto a common time grid
+
+    The grid spans the observation period with a step of dt. Times outside of either series are nan. The gauges are
+    read through the gauge archive, which writes outdir/gauges.npz if it is out of date (see gauges.read_column).
+
+    :param str outdir: output directory of the run
+    :param float dt: step of the time grid (s), the NOAA water levels are 6 minute data
+    :param str cache_dir: directory of the observation store
+    :return: the gauge numbers, the times of the grid in seconds relative to landfall, and the modelled and observed
+            surge as arrays with one row per gauge
+    """
+    station_ids = dict(enumerate((station_id for (station_id, _) in observations.stations), start=1))
+    paths = {gaugeno: path for (gaugeno, path) in gauges.gauge_files(outdir).items() if gaugeno in station_ids}
+    observed = observations.load_observations([station_ids[gaugeno] for gaugeno in paths], cache_dir=cache_dir)
+
+    def to_seconds(date):
+        return (np.asarray(date, dtype="datetime64[s]") - observations.landfall_time) / np.timedelta64(1, 's')
+
+    t = np.arange(to_seconds(observations.begin_date), to_seconds(observations.end_date) + dt / 2, dt)
+
+    model = np.full((len(paths), len(t)), np.nan)
+    obs = np.full((len(paths), len(t)), np.nan)
+    for (i, (gaugeno, path)) in enumerate(paths.items()):
+        gauge_t, eta = gauges.read_column(gaugeno, "t", outdir), gauges.read_column(gaugeno, "eta", outdir)
+        if gauge_t.size:
+            model[i] = np.interp(t, gauge_t, eta, left=np.nan, right=np.nan)
+        if station_ids[gaugeno] not in observed:
+            continue
+        date_time, surge = observed[station_ids[gaugeno]]
+        valid = np.isfinite(surge)
+        if valid.any():
+            obs[i] = np.interp(t, to_seconds(date_time[valid]), surge[valid], left=np.nan, right=np.nan)
+    return list(paths), t, model, obs
+
+
+def skill(outdir="_output", dt=360.0, cache_dir=observations.scratch_dir):
+    """Computes the skill metrics of every gauge with a NOAA station
+
+    Only times at which both the model and the observations are defined are used. Peak errors are model minus
+    observation, in m and in seconds.
+
+    :param str outdir: output directory of the run
+    :param float dt: step of the common time grid (s)
+    :param str cache_dir: directory of the observation store
+    :return: a dictionary of gauge numbers with dictionaries of the metrics, nan if a gauge has no overlap
+    """
+    gaugenos, t, model, obs = align(outdir, dt, cache_dir)
+
+    mask = np.isfinite(model) & np.isfinite(obs)
+    count = mask.sum(axis=1)
+    m = np.where(mask, model, 0.0)
+    o = np.where(mask, obs, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        error = m - o
+        rmse = np.sqrt((error ** 2).sum(axis=1) / count)
+        bias = error.sum(axis=1) / count
+
+        model_peak = np.argmax(np.where(mask, model, -np.inf), axis=1)
+        obs_peak = np.argmax(np.where(mask, obs, -np.inf), axis=1)
+        rows = np.arange(len(gaugenos))
+        peak_error = np.where(count > 0, model[rows, model_peak] - obs[rows, obs_peak], np.nan)
+        peak_time_error = np.where(count > 0, t[model_peak] - t[obs_peak], np.nan)
+
+        obs_mean = (o.sum(axis=1) / count)[:, np.newaxis]
+        potential = np.where(mask, (np.abs(m - obs_mean) + np.abs(o - obs_mean)) ** 2, 0.0).sum(axis=1)
+        willmott = 1.0 - (error ** 2).sum(axis=1) / potential
+
+    values = dict(zip(metrics, (rmse, bias, peak_error, peak_time_error, willmott)))
+    return {gaugeno: {name: float(values[name][i]) for name in metrics} for (i, gaugeno) in enumerate(gaugenos)}
+
+
+def write_skill(results, path):
+    """Writes the skill metrics to a .csv (one row per gauge) or .json file
+
+    :param dict results: metrics as returned by skill
+    :param str path: output file, the format follows its extension
+    """
+    names = dict(observations.stations)
+    station_ids = [station_id for (station_id, _) in observations.stations]
+    rows = [dict(gauge=gaugeno, station_id=station_ids[gaugeno - 1], station=names[station_ids[gaugeno - 1]],
+                 **values) for (gaugeno, values) in results.items()]
+
+    if os.path.splitext(path)[1] == ".json":
+        with open(path, "w") as json_file:
+            # nan is not valid JSON
+            json.dump([{key: (None if value != value else value) for (key, value) in row.items()} for row in rows],
+                      json_file, indent=2)
+    else:
+        with open(path, "w", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=["gauge", "station_id", "station"] + metrics)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    outdir = sys.argv[1] if len(sys.argv) > 1 else "_output"
+    path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(outdir, "skill.csv")
+    results = skill(outdir)
+    write_skill(results, path)
+    for (gaugeno, values) in results.items():
+        print("Gauge %s:  " % gaugeno + "  ".join("%s = %.3f" % (name, values[name]) for name in metrics))
+    print("Skill metrics written to %s" % path)
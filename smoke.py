@@ -0,0 +1,90 @@
+"""
+Regression check of a run with the "smoke" profile of setrun against stored reference gauge peaks.
+
+    make smoke
+
+runs setrun with MATTHEW_PROFILE=smoke, xgeoclaw and the plots in _output_smoke and _plots_smoke, and then
+
+    python smoke.py _output_smoke
+
+compares the peak surge at each gauge, and its time, with smoke_reference.json, failing when there is no reference.
+The reference is recorded from a checked smoke run, and again after an intended change of the results, with
+
+    python smoke.py _output_smoke --record
+"""
+
+import os
+import sys
+import json
+
+import gauges
+
+
+reference_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "smoke_reference.json")
+
+# Differences from the reference accepted as unchanged, in m and s
+peak_tol = 0.01
+peak_time_tol = 600.0
+
+
+def record(outdir="_output_smoke", path=reference_file):
+    """Stores the gauge peaks of a smoke run as the reference
+
+    :param str outdir: output directory of the smoke run
+    :param str path: reference file
+    """
+    peaks = {str(gaugeno): {"peak": float(peak["peak"]), "peak_time": float(peak["peak_time"])}
+             for (gaugeno, peak) in gauges.gauge_peaks(outdir, archive=False).items()}
+    with open(path, "w") as reference:
+        json.dump(peaks, reference, indent=2)
+
+
+def check(outdir="_output_smoke", path=reference_file, peak_tol=peak_tol, peak_time_tol=peak_time_tol):
+    """Compares the gauge peaks of a smoke run with the reference
+
+    :param str outdir: output directory of the smoke run
+    :param str path: reference file
+    :param float peak_tol: accepted difference of the peak surge (m)
+    :param float peak_time_tol: accepted difference of the time of the peak (s)
+    :return: a list of messages describing each regression, empty if the run matches the reference
+    """
+    if not os.path.exists(path):
+        raise IOError("No reference gauge peaks in %s, record them with python smoke.py %s --record" % (path, outdir))
+    with open(path, "r") as reference_json:
+        reference = {int(gaugeno): values for (gaugeno, values) in json.load(reference_json).items()}
+    peaks = gauges.gauge_peaks(outdir, archive=False)
+
+    regressions = []
+    for (gaugeno, expected) in reference.items():
+        if gaugeno not in peaks:
+            regressions.append("Gauge %s: no output" % gaugeno)
+            continue
+        peak = peaks[gaugeno]
+        if abs(peak["peak"] - expected["peak"]) > peak_tol:
+            regressions.append("Gauge %s: surge %.3f m, reference %.3f m" % (gaugeno, peak["peak"], expected["peak"]))
+        if abs(peak["peak_time"] - expected["peak_time"]) > peak_time_tol:
+            regressions.append("Gauge %s: peak at %.0f s, reference %.0f s" % (gaugeno, peak["peak_time"],
+                                                                              expected["peak_time"]))
+    return regressions
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != "--record"]
+    outdir = args[0] if args else "_output_smoke"
+    if not gauges.gauge_files(outdir):
+        sys.exit("No gauge output in %s, run make smoke first" % outdir)
+    if "--record" in sys.argv:
+        record(outdir)
+        print("Reference gauge peaks written to %s, commit it so that later smoke runs are checked against it" %
+              reference_file)
+        sys.exit()
+
+    try:
+        regressions = check(outdir)
+    except IOError as e:
+        sys.exit(str(e))
+    for regression in regressions:
+        print(regression)
+    if regressions:
+        sys.exit("Smoke run differs from the reference in %s places" % len(regressions))
+    print("Smoke run matches the reference gauge peaks")
@@ -0,0 +1,105 @@
+"""
+Tests of the resumable download in prefetch.py against a local HTTP server.
+
+    python -m pytest test_prefetch.py      (or python -m unittest test_prefetch)
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import prefetch
+
+
+payload = bytes(range(256)) * 4096
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    # Serves payload at any path, honouring "Range: bytes=N-" unless the server ignores ranges. With cut_after set, the
+    # first response is cut off after that many bytes, as an interrupted download
+    def do_GET(self):
+        server = self.server
+        server.ranges.append(self.headers.get("Range"))
+        start = 0
+        if self.headers.get("Range") and not server.ignore_range:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            if start >= len(payload):
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%s" % len(payload))
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %s-%s/%s" % (start, len(payload) - 1, len(payload)))
+        else:
+            self.send_response(200)
+        body = payload[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if server.cut_after is not None:
+            body, server.cut_after = body[:server.cut_after], None
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+        self.server.ranges = []
+        self.server.ignore_range = False
+        self.server.cut_after = None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.remote = {"url": "http://127.0.0.1:%s/input.bin" % self.server.server_address[1],
+                       "file_name": "input.bin"}
+        self.path = os.path.join(self.output_dir, "input.bin")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.output_dir)
+
+    def test_resume_part(self):
+        # Only the rest of an interrupted download is requested
+        with open(self.path + ".part", "wb") as part_file:
+            part_file.write(payload[:100000])
+        prefetch.fetch(self.remote, self.output_dir, timeout=5)
+        with open(self.path, "rb") as fetched:
+            self.assertEqual(fetched.read(), payload)
+        self.assertEqual(self.server.ranges, ["bytes=100000-"])
+        self.assertFalse(os.path.exists(self.path + ".part"))
+
+    def test_resume_interrupted(self):
+        # A connection cut off mid-transfer is resumed from where it stopped
+        self.server.cut_after = 300000
+        prefetch.fetch(self.remote, self.output_dir, timeout=5)
+        with open(self.path, "rb") as fetched:
+            self.assertEqual(fetched.read(), payload)
+        self.assertEqual(self.server.ranges, [None, "bytes=300000-"])
+
+    def test_range_ignored(self):
+        # A server that ignores the range sends the whole file, which replaces the .part file
+        self.server.ignore_range = True
+        with open(self.path + ".part", "wb") as part_file:
+            part_file.write(b"x" * 1000)
+        prefetch.fetch(self.remote, self.output_dir, timeout=5)
+        with open(self.path, "rb") as fetched:
+            self.assertEqual(fetched.read(), payload)
+
+    def test_manifest_unchanged(self):
+        # The manifest is written by the first prefetch only
+        prefetch.prefetch([self.remote], self.output_dir, timeout=5)
+        manifest_path = os.path.join(self.output_dir, "prefetch.json")
+        os.utime(manifest_path, (0, 0))
+        prefetch.prefetch([self.remote], self.output_dir, timeout=5)
+        self.assertEqual(os.path.getmtime(manifest_path), 0)
+        self.assertEqual(self.server.ranges, [None])
+
+
+if __name__ == '__main__':
+    unittest.main()